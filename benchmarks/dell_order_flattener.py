@@ -0,0 +1,89 @@
+"""
+Memory benchmark of the Dell order status response flattening on the large synthetic response.
+
+Compares the layered flattener of the connector with the previous implementation copying the whole accumulated dict
+for every service tag. Both are measured under the same consumption: `retained` keeps all the records in the list as
+the previous connector did, `streamed` drops every record once it is counted as the sync does now. Run from the root
+of the connector:
+
+    python benchmarks/dell_order_flattener.py --orders 20 --tags 500
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connectors.dell_asset_order_status import Connector  # noqa: E402
+
+IGNORE_KEYS = ["productInfo", "trackingInformation", "shipToInformation", "purchaseOrderLines"]
+
+
+def generate_response(orders: int, products: int, tags: int) -> dict:
+    purchase_orders = []
+    for order_number in range(orders):
+        dell_orders = [{
+            'orderNumber': f'{order_number}-{dell_order}',
+            'orderStatus': 'Shipped',
+            'shipToInformation': {'name': 'ACME', 'address': {'line': '1 Main St', 'city': 'Austin', 'country': 'US'}},
+            'productInfo': [{
+                'productId': f'P{product}',
+                'description': 'Latitude 7440',
+                'serviceTags': [f'TAG{order_number}{dell_order}{product}{tag:05d}' for tag in range(tags)],
+            } for product in range(products)],
+        } for dell_order in range(2)]
+        purchase_orders.append({'purchaseOrderNumber': f'PO{order_number}', 'dellOrders': dell_orders})
+    return {'purchaseOrderDetails': purchase_orders}
+
+
+def legacy_flatten(response: dict):
+    """
+    The previous implementation: the single mutated dict copied for every service tag
+    """
+    for order in response['purchaseOrderDetails']:
+        final_dict = {key: value for key, value in order.items() if key != 'dellOrders'}
+        for dell_order in order.get('dellOrders', []):
+            final_dict.update({key: value for key, value in dell_order.items() if key not in IGNORE_KEYS})
+            for product_info in dell_order.get('productInfo', []):
+                final_dict.update({key: value for key, value in product_info.items() if key != 'serviceTags'})
+                for serial_number in product_info['serviceTags']:
+                    final_dict['serialnumber'] = serial_number
+                    final_dict['shipToInformation'] = dell_order['shipToInformation']
+                    yield final_dict.copy()
+
+
+def measure(label, consume):
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = consume()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>17}: {count} records in {elapsed:.3f}s, peak memory {peak / 1024 / 1024:.1f} MB")
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=10)
+    parser.add_argument('--products', type=int, default=2)
+    parser.add_argument('--tags', type=int, default=500, help="Service tags per product")
+    args = parser.parse_args()
+
+    response = generate_response(args.orders, args.products, args.tags)
+    connector = Connector.__new__(Connector)
+
+    legacy_retained = measure('legacy retained', lambda: len(list(legacy_flatten(response))))
+    layered_retained = measure('layered retained', lambda: len(list(connector.create_dell_response_dict(response))))
+    legacy_streamed = measure('legacy streamed', lambda: sum(1 for _ in legacy_flatten(response)))
+    layered_streamed = measure('layered streamed', lambda: sum(1 for _ in connector.create_dell_response_dict(response)))
+
+    print(f"peak memory ratio, legacy / layered: retained {legacy_retained / layered_retained:.1f}x, "
+          f"streamed {legacy_streamed / layered_streamed:.1f}x")
+    # the records are equal in size, the gain of the connector comes from streaming them instead of collecting them
+    print(f"peak memory ratio, retained / streamed: {layered_retained / layered_streamed:.1f}x")
+
+if __name__ == '__main__':
+    main()
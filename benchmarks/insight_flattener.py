@@ -0,0 +1,95 @@
+"""
+Benchmark of the Insight response flattening on the large synthetic StatusOrderResponse.
+
+Compares the indexed flattener of the connector with the previous implementation scanning all the tracking entries
+for every serial number. Run from the root of the connector:
+
+    python benchmarks/insight_flattener.py --orders 20 --serials 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connectors.insight import Connector, FLATTEN_IGNORE_KEYS  # noqa: E402
+
+
+def generate_response(orders: int, line_items: int, serials: int) -> dict:
+    order_list = []
+    for order_number in range(orders):
+        line_item_list = []
+        tracking = []
+        for line in range(line_items):
+            serial_numbers = [{'SerialNumber': f' SN{order_number}-{line}-{serial} '} for serial in range(serials)]
+            tracking.extend(
+                {'SerialNumber': f'SN{order_number}-{line}-{serial}', 'Carrier': 'UPS', 'TrackingNumber': f'1Z{serial:08d}'}
+                for serial in range(serials)
+            )
+            line_item_list.append({
+                'LineNumber': line,
+                'MaterialNumber': f'MAT-{line}',
+                'Description': 'Laptop',
+                'Delivery': [{
+                    'DeliveryNumber': f'D{order_number}-{line}',
+                    'ShipDate': '2024-01-01',
+                    'SerialNumbers': serial_numbers,
+                    'BillingInformation': [{'InvoiceNumber': f'INV{order_number}-{line}', 'Price': '999.00'}],
+                }],
+            })
+        order_list.append({
+            'OrderHeader': [{'OrderNumber': order_number, 'ClientID': '1', 'OrderDate': '2024-01-01'}],
+            'Tracking': tracking,
+            'OrderLineItems': line_item_list,
+        })
+    return {'StatusOrderResponse': [{'Order': order_list}]}
+
+
+def legacy_flatten(response: dict):
+    """
+    The previous implementation: linear scan of the tracking per serial number and the single mutated dict
+    """
+    for orders in response['StatusOrderResponse']:
+        for order in orders['Order']:
+            final_dict = dict(order['OrderHeader'][0])
+            for order_item in order['OrderLineItems']:
+                final_dict.update({k: v for k, v in order_item.items() if k not in FLATTEN_IGNORE_KEYS})
+                for delivery in order_item.get('Delivery', []):
+                    final_dict.update({k: v for k, v in delivery.items() if k not in FLATTEN_IGNORE_KEYS})
+                    for serial_number_dict in delivery.get('SerialNumbers', []):
+                        serial_number = serial_number_dict['SerialNumber'].strip()
+                        final_dict['SerialNumber'] = serial_number
+                        for tracking in order['Tracking']:
+                            if tracking.get('SerialNumber') == serial_number:
+                                final_dict.update(tracking)
+                        final_dict.update(delivery['BillingInformation'][0])
+                        yield final_dict
+
+
+def measure(label, records_iterator):
+    started = time.perf_counter()
+    count = sum(1 for _ in records_iterator)
+    elapsed = time.perf_counter() - started
+    print(f"{label:>10}: {count} records in {elapsed:.3f}s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=10)
+    parser.add_argument('--line-items', type=int, default=2)
+    parser.add_argument('--serials', type=int, default=1000, help="Serial numbers per line item")
+    args = parser.parse_args()
+
+    response = generate_response(args.orders, args.line_items, args.serials)
+
+    legacy = measure('legacy', legacy_flatten(response))
+    indexed = measure('indexed', (record for orders in response['StatusOrderResponse']
+                                  for order in orders['Order']
+                                  for record in Connector.flatten_order(order)))
+    print(f"speedup: {legacy / indexed:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
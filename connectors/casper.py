@@ -1,13 +1,20 @@
 import json
+import math
+import re
 import urllib.error
 import urllib.parse
 import urllib.request
 
+import arrow
 import gevent
 from gevent.pool import Pool
+from constants import TRUE_VALUES
 from lib.connector import AssetsConnector
 from lib.error import ConfigError
 from requests import HTTPError
+from requests.exceptions import RequestException
+from utils.concurrency import AdaptiveConcurrencyMixin
+from utils.state_store import get_state_store
 
 COMPUTERS = 'computers'
 MOBILE_DEVICES = 'mobiledevices'
@@ -19,18 +26,164 @@ SyncTypes = {
         group_ids_path="JSSResource/computergroups/name/{name}",
         array="computers",
         data="computer",
+        report_dates_path="JSSResource/computers/subset/basic",
+        inventory_path="api/v1/computers-inventory",
+        inventory_report_date="reportDate",
+        inventory_sections=(
+            'GENERAL', 'DISK_ENCRYPTION', 'PURCHASING', 'APPLICATIONS', 'STORAGE', 'USER_AND_LOCATION',
+            'CONFIGURATION_PROFILES', 'PRINTERS', 'SERVICES', 'HARDWARE', 'LOCAL_USER_ACCOUNTS', 'CERTIFICATES',
+            'ATTACHMENTS', 'PLUGINS', 'PACKAGE_RECEIPTS', 'FONTS', 'SECURITY', 'OPERATING_SYSTEM', 'LICENSED_SOFTWARE',
+            'IBEACONS', 'SOFTWARE_UPDATES', 'EXTENSION_ATTRIBUTES', 'CONTENT_CACHING', 'GROUP_MEMBERSHIPS',
+        ),
     ),
     MOBILE_DEVICES: dict(
         all_ids_path="JSSResource/mobiledevices",
         group_ids_path="JSSResource/mobiledevicegroups/name/{name}",
         array="mobile_devices",
         data="mobile_device",
+        report_dates_path=None,
+        inventory_path="api/v2/mobile-devices/detail",
+        inventory_report_date="lastInventoryUpdateDate",
+        inventory_sections=(
+            'GENERAL', 'HARDWARE', 'USER_AND_LOCATION', 'PURCHASING', 'SECURITY', 'APPLICATIONS', 'EBOOKS', 'NETWORK',
+            'SERVICE_SUBSCRIPTIONS', 'CERTIFICATES', 'PROFILES', 'USER_PROFILES', 'PROVISIONING_PROFILES',
+            'SHARED_USERS', 'EXTENSION_ATTRIBUTES',
+        ),
     ),
 }
 
-class Connector(AssetsConnector):
+INVENTORY_TOKEN_PATH = "api/v1/auth/token"
+
+# the field absent in the inventory API record, unlike the field with the empty value
+MISSING = object()
+
+# The last report date of every device synced by the incremental sync, the latest report date loaded from
+# the inventory API and the time of the last full sync
+REPORT_DATES_NAMESPACE = 'casper.report_dates'
+INVENTORY_WATERMARK_NAMESPACE = 'casper.inventory_watermark'
+FULL_SYNC_NAMESPACE = 'casper.full_sync'
+DEFAULT_FULL_SYNC_INTERVAL_DAYS = 7
+
+# The devices failed to be fetched are retried at the end of the sync after these delays in seconds,
+# the ones still failing are kept in the state store and fetched by the next sync
+RETRY_QUEUE_NAMESPACE = 'casper.retry_queue'
+RETRY_DELAYS = (5, 30, 120)
+DEFAULT_INVENTORY_PAGE_SIZE = 100
+
+# The sections of the Jamf Pro inventory API carrying the data of the classic API subsets
+INVENTORY_SECTIONS = {
+    'General': ('GENERAL', 'HARDWARE'),
+    'Location': ('USER_AND_LOCATION',),
+    'Purchasing': ('PURCHASING',),
+    'Hardware': ('HARDWARE', 'OPERATING_SYSTEM', 'STORAGE'),
+    'Software': ('APPLICATIONS',),
+    'Extension_attributes': ('EXTENSION_ATTRIBUTES',),
+    'Extensionattributes': ('EXTENSION_ATTRIBUTES',),
+    'Security': ('SECURITY',),
+    'Groups_accounts': ('GROUP_MEMBERSHIPS', 'LOCAL_USER_ACCOUNTS'),
+    'Configuration_profiles': ('CONFIGURATION_PROFILES',),
+    'Certificates': ('CERTIFICATES',),
+}
+
+# The sections of the Jamf Pro inventory API named differently in the classic API
+INVENTORY_SECTION_NAMES = {
+    'user_and_location': 'location',
+    'applications': 'software',
+}
+
+# The fields of the classic API records named differently or located in the other sections of the Jamf Pro
+# inventory API records, (classic section, classic field): path in the converted inventory record
+INVENTORY_FIELD_ALIASES = {
+    COMPUTERS: {
+        ('general', 'id'): ('id',),
+        ('general', 'udid'): ('udid',),
+        ('general', 'serial_number'): ('hardware', 'serial_number'),
+        ('general', 'mac_address'): ('hardware', 'mac_address'),
+        ('general', 'alt_mac_address'): ('hardware', 'alt_mac_address'),
+        ('general', 'model'): ('hardware', 'model'),
+        ('general', 'ip_address'): ('general', 'last_ip_address'),
+        ('general', 'jamf_version'): ('general', 'jamf_binary_version'),
+        ('general', 'barcode_1'): ('general', 'barcode1'),
+        ('general', 'barcode_2'): ('general', 'barcode2'),
+        ('general', 'report_date_utc'): ('general', 'report_date'),
+        ('general', 'last_contact_time_utc'): ('general', 'last_contact_time'),
+        ('general', 'initial_entry_date_utc'): ('general', 'initial_entry_date'),
+        ('general', 'last_enrolled_date_utc'): ('general', 'last_enrolled_date'),
+        ('hardware', 'os_name'): ('operating_system', 'name'),
+        ('hardware', 'os_version'): ('operating_system', 'version'),
+        ('hardware', 'os_build'): ('operating_system', 'build'),
+        ('hardware', 'active_directory_status'): ('operating_system', 'active_directory_status'),
+        ('hardware', 'total_ram'): ('hardware', 'total_ram_megabytes'),
+        ('hardware', 'total_ram_mb'): ('hardware', 'total_ram_megabytes'),
+        ('hardware', 'number_processors'): ('hardware', 'processor_count'),
+        ('hardware', 'number_cores'): ('hardware', 'core_count'),
+        ('hardware', 'processor_speed'): ('hardware', 'processor_speed_mhz'),
+        ('hardware', 'bus_speed'): ('hardware', 'bus_speed_mhz'),
+        ('hardware', 'cache_size'): ('hardware', 'cache_size_kilobytes'),
+        ('hardware', 'cache_size_kb'): ('hardware', 'cache_size_kilobytes'),
+        ('hardware', 'available_ram_slots'): ('hardware', 'open_ram_slots'),
+        ('hardware', 'battery_capacity'): ('hardware', 'battery_capacity_percent'),
+        ('hardware', 'sip_status'): ('security', 'sip_status'),
+        ('hardware', 'gatekeeper_status'): ('security', 'gatekeeper_status'),
+        ('hardware', 'xprotect_version'): ('security', 'xprotect_version'),
+        ('location', 'real_name'): ('location', 'realname'),
+        ('location', 'email_address'): ('location', 'email'),
+        ('location', 'phone_number'): ('location', 'phone'),
+        ('purchasing', 'is_purchased'): ('purchasing', 'purchased'),
+        ('purchasing', 'is_leased'): ('purchasing', 'leased'),
+        ('purchasing', 'applecare_id'): ('purchasing', 'apple_care_id'),
+        ('purchasing', 'po_date_utc'): ('purchasing', 'po_date'),
+        ('purchasing', 'warranty_expires'): ('purchasing', 'warranty_date'),
+        ('purchasing', 'warranty_expires_utc'): ('purchasing', 'warranty_date'),
+        ('purchasing', 'lease_expires'): ('purchasing', 'lease_date'),
+        ('purchasing', 'lease_expires_utc'): ('purchasing', 'lease_date'),
+    },
+    MOBILE_DEVICES: {
+        ('general', 'id'): ('mobile_device_id',),
+        ('general', 'name'): ('general', 'display_name'),
+        ('general', 'device_name'): ('general', 'display_name'),
+        ('general', 'serial_number'): ('hardware', 'serial_number'),
+        ('general', 'wifi_mac_address'): ('hardware', 'wifi_mac_address'),
+        ('general', 'bluetooth_mac_address'): ('hardware', 'bluetooth_mac_address'),
+        ('general', 'modem_firmware'): ('hardware', 'modem_firmware_version'),
+        ('general', 'model'): ('hardware', 'model'),
+        ('general', 'model_identifier'): ('hardware', 'model_identifier'),
+        ('general', 'model_number'): ('hardware', 'model_number'),
+        ('general', 'capacity'): ('hardware', 'capacity_mb'),
+        ('general', 'capacity_mb'): ('hardware', 'capacity_mb'),
+        ('general', 'available'): ('hardware', 'available_space_mb'),
+        ('general', 'available_mb'): ('hardware', 'available_space_mb'),
+        ('general', 'percentage_used'): ('hardware', 'used_space_percentage'),
+        ('general', 'battery_level'): ('hardware', 'battery_level'),
+        ('general', 'last_inventory_update'): ('general', 'last_inventory_update_date'),
+        ('general', 'last_inventory_update_utc'): ('general', 'last_inventory_update_date'),
+        ('general', 'device_ownership_level'): ('general', 'device_ownership_type'),
+        ('location', 'realname'): ('location', 'real_name'),
+        ('location', 'phone'): ('location', 'phone_number'),
+        ('purchasing', 'is_purchased'): ('purchasing', 'purchased'),
+        ('purchasing', 'is_leased'): ('purchasing', 'leased'),
+        ('purchasing', 'applecare_id'): ('purchasing', 'apple_care_id'),
+        ('purchasing', 'warranty_expires'): ('purchasing', 'warranty_expires_date'),
+        ('purchasing', 'lease_expires'): ('purchasing', 'lease_expires_date'),
+    },
+}
+
+
+def to_snake_case(value):
+    """
+    Recursively convert the camelCase keys of the Jamf Pro API payload to the snake_case keys of the classic API
+    """
+    if isinstance(value, dict):
+        return {re.sub(r'(?<!^)(?=[A-Z])', '_', key).lower(): to_snake_case(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_snake_case(item) for item in value]
+    return value
+
+
+class Connector(AdaptiveConcurrencyMixin, AssetsConnector):
     MappingName = 'Casper'
     RetryCount = 10
+    MaxConcurrency = 10
 
     sync_config = None
 
@@ -40,6 +193,13 @@ class Connector(AssetsConnector):
         'password':    {'order': 3, 'example': "change-me"},
         'sync_type':   {'order': 5, 'default': COMPUTERS, 'choices': (COMPUTERS, MOBILE_DEVICES)},
         'group_name':  {'order': 7, 'default': ""},
+        'inventory_api': {'order': 8, 'default': "False"},
+        'inventory_page_size': {'order': 9, 'default': str(DEFAULT_INVENTORY_PAGE_SIZE)},
+        'incremental_sync': {'order': 10, 'default': "False"},
+        'full_sync_interval_days': {'order': 11, 'default': str(DEFAULT_FULL_SYNC_INTERVAL_DAYS)},
+        'adaptive_concurrency': {'order': 12, 'default': "False"},
+        'min_concurrency': {'order': 13, 'default': "1"},
+        'max_concurrency': {'order': 14, 'default': "10"},
     }
     DefaultConverters = {
         "general.report_date":         "date_format",
@@ -50,7 +210,7 @@ class Connector(AssetsConnector):
         "purchasing.po_date":          "date_format",
     }
 
-    def get_details_url(self, sync_type):
+    def get_subsets(self):
         # try to extract data subsets to make request more efficient and quick
         subsets = None
         try:
@@ -64,6 +224,23 @@ class Connector(AssetsConnector):
                 if 'casper_extension_attribute' in _.get('converter', ''):
                     subsets |= {'ExtensionAttributes'}
 
+        return subsets
+
+    def get_inventory_sections(self):
+        """
+        Translate the subsets of the classic API to the sections of the Jamf Pro inventory API.
+        If any of the subsets is unknown all the sections are requested
+        """
+        available_sections = SyncTypes[self.sync_type]['inventory_sections']
+        subsets = self.get_subsets()
+        if not subsets or any(subset.capitalize() not in INVENTORY_SECTIONS for subset in subsets):
+            return list(available_sections)
+
+        sections = {section for subset in subsets for section in INVENTORY_SECTIONS[subset.capitalize()]}
+        return [section for section in available_sections if section in sections]
+
+    def get_details_url(self, sync_type):
+        subsets = self.get_subsets()
         if subsets:
             details_url = self.url_template.format(
                 "JSSResource/%s/id/{}/subset/%s" % (sync_type, '&'.join(subsets))
@@ -134,6 +311,23 @@ class Connector(AssetsConnector):
             self.ids_converter = lambda data: data[self.sync_config['array']]
 
         self.details_url = self.get_details_url(self.sync_type)
+        # the mapped sources already reported as missing in the inventory API records
+        self.unresolved_sources = set()
+
+        # The paginated Jamf Pro inventory API loads the whole fleet in a few hundred calls instead of the call per device
+        self.inventory_api = self.settings.get('inventory_api', 'False') in TRUE_VALUES
+        self.inventory_page_size = int(self.settings.get('inventory_page_size') or DEFAULT_INVENTORY_PAGE_SIZE)
+        self.inventory_token = ""
+        self.inventory_token_expires = 0
+        self.inventory_filter = None
+
+        # The incremental sync fetches the details only of the devices reported to Jamf since the previous sync,
+        # all the devices are fetched once in `full_sync_interval_days`
+        self.incremental_sync = self.settings.get('incremental_sync', 'False') in TRUE_VALUES
+        self.full_sync_interval_days = int(self.settings.get('full_sync_interval_days') or DEFAULT_FULL_SYNC_INTERVAL_DAYS)
+        self.state_key = f"{self.settings['url']}:{self.sync_type}"
+
+        self.init_concurrency('Casper')
 
     def get_headers(self):
         return {
@@ -143,20 +337,255 @@ class Connector(AssetsConnector):
     def get_auth(self):
         return self.settings['username'], self.settings['password']
 
+    def get_inventory_headers(self):
+        if round(arrow.utcnow().float_timestamp) > self.inventory_token_expires:
+            response = self._get_session().post(
+                self.url_template.format(INVENTORY_TOKEN_PATH),
+                auth=self.get_auth(),
+                headers={'Accept': 'application/json'},
+                verify=self.get_verification()
+            )
+            response.raise_for_status()
+            token = response.json()
+            self.inventory_token = token['token']
+            # refresh the token a minute before it expires
+            self.inventory_token_expires = round(arrow.get(token['expires']).float_timestamp) - 60
+        return {
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {self.inventory_token}'
+        }
+
+    def fetch_inventory_page(self, page):
+        params = [('page', page), ('page-size', self.inventory_page_size), ('sort', 'id:asc')]
+        params.extend(('section', section) for section in self.get_inventory_sections())
+        if self.inventory_filter:
+            params.append(('filter', self.inventory_filter))
+        url = self.url_template.format(self.sync_config['inventory_path'])
+        request_kwargs = dict(params=params, headers=self.get_inventory_headers(), verify=self.get_verification())
+        if self.concurrency:
+            response = self.concurrency.call(self._get_session().get, url, **request_kwargs)
+        else:
+            response = self._get_session().get(url, **request_kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def convert_inventory_record(record, field_aliases=INVENTORY_FIELD_ALIASES[COMPUTERS]):
+        """
+        Reshape the record of the Jamf Pro inventory API to the layout of the classic API record, so the same mapping applies
+        """
+        record = to_snake_case(record)
+        for name, classic_name in INVENTORY_SECTION_NAMES.items():
+            if name in record:
+                record[classic_name] = record.pop(name)
+        if isinstance(record.get('software'), list):
+            record['software'] = {'applications': record['software']}
+        for attribute in record.get('extension_attributes') or []:
+            if 'values' in attribute and 'value' not in attribute:
+                attribute['value'] = ', '.join(map(str, attribute['values'] or []))
+
+        for (section, field), source in field_aliases.items():
+            # the empty values are aliased too, so the field present in the API is not reported as unresolved
+            value = record
+            for key in source:
+                value = value[key] if isinstance(value, dict) and key in value else MISSING
+            if value is not MISSING:
+                target = record.setdefault(section, {})
+                if isinstance(target, dict):
+                    target.setdefault(field, value)
+        return record
+
+    def report_unresolved_sources(self, record):
+        """
+        Warn once per sync about the mapped sources missing in the converted inventory record,
+        they have no counterpart in the Jamf Pro inventory API and are not synced
+        """
+        for mapping in self.field_mappings.values():
+            source = mapping.get('source') if isinstance(mapping, dict) else None
+            if not source or source in self.unresolved_sources:
+                continue
+
+            value = record
+            for key in str(source).split('.'):
+                if not isinstance(value, dict):
+                    break
+                if key not in value:
+                    self.unresolved_sources.add(source)
+                    self.logger.warning("Mapped source %r is not available in the Jamf Pro inventory API records", source)
+                    break
+                value = value[key]
+
+    def load_inventory_records(self, connection_pool, full_sync=True):
+        """
+        Load the records page by page from the Jamf Pro inventory API, the pages after the first one are fetched concurrently.
+        The incremental sync requests only the devices reported since the latest report date of the previous sync
+        :return: None if the API is not available, so the classic API is used instead
+        """
+        report_date_field = self.sync_config['inventory_report_date']
+        self.unresolved_sources = set()
+        watermark = None
+        if self.incremental_sync:
+            watermark = get_state_store().get_value(INVENTORY_WATERMARK_NAMESPACE, self.state_key)
+            if watermark and not full_sync:
+                self.inventory_filter = f'general.{report_date_field}=ge="{watermark}"'
+
+        try:
+            first_page = self.fetch_inventory_page(0)
+        except (RequestException, KeyError, ValueError) as exc:
+            self.logger.warning("Jamf Pro inventory API is not available (%s), using the classic API", exc)
+            return None
+
+        pages_count = math.ceil(first_page.get('totalCount', 0) / self.inventory_page_size)
+        self.logger.info("Loading %s devices from the Jamf Pro inventory API in %s pages",
+                         first_page.get('totalCount', 0), pages_count)
+
+        def iterate_pages():
+            yield first_page
+            yield from connection_pool.imap(self.fetch_inventory_page, range(1, pages_count), maxsize=connection_pool.size)
+
+        def iterate_records():
+            latest_report_date = watermark
+            for page in iterate_pages():
+                for record in page.get('results', []):
+                    report_date = (record.get('general') or {}).get(report_date_field)
+                    if report_date and (not latest_report_date or report_date > latest_report_date):
+                        latest_report_date = report_date
+                    record = self.convert_inventory_record(record, INVENTORY_FIELD_ALIASES[self.sync_type])
+                    self.report_unresolved_sources(record)
+                    yield record
+
+            if self.incremental_sync and latest_report_date:
+                get_state_store().set(INVENTORY_WATERMARK_NAMESPACE, self.state_key, latest_report_date)
+
+        return iterate_records()
+
+    def is_full_sync_due(self) -> bool:
+        last_full_sync = get_state_store().get_value(FULL_SYNC_NAMESPACE, self.state_key)
+        return not last_full_sync or arrow.get(last_full_sync) < arrow.utcnow().shift(days=-self.full_sync_interval_days)
+
+    def fetch_report_dates(self):
+        """
+        Return the map of the device ID to the date of its last inventory report, if Jamf lists them for the sync type
+        """
+        if not self.sync_config['report_dates_path']:
+            self.logger.warning("Jamf does not list the report dates of %s, all the devices are synced", self.sync_type)
+            return {}
+
+        try:
+            response = self.get(self.url_template.format(self.sync_config['report_dates_path']))
+            return {str(device['id']): device.get('report_date_epoch') for device in response.json()[self.sync_config['array']]}
+        except HTTPError:
+            self.logger.exception("Error loading the report dates from Casper, all the devices are synced.")
+            return {}
+
+    def select_changed_assets(self, asset_ids, report_dates):
+        """
+        Keep only the devices which are new or reported to Jamf since the previous sync
+        """
+        synced_report_dates = get_state_store().get_all(f"{REPORT_DATES_NAMESPACE}:{self.state_key}")
+        changed_ids = [
+            asset_id for asset_id in asset_ids
+            if report_dates.get(str(asset_id)) is None or synced_report_dates.get(str(asset_id)) != report_dates[str(asset_id)]
+        ]
+        self.logger.info("Incremental sync: %s of %s devices have changed since the previous sync", len(changed_ids), len(asset_ids))
+        return changed_ids
+
+    def save_report_date(self, asset_id, report_date):
+        if report_date is not None:
+            get_state_store().set(f"{REPORT_DATES_NAMESPACE}:{self.state_key}", str(asset_id), report_date)
+
     def _load_records(self, options):
-        pool_size = self.settings['__workers__']
+        pool_size = self.get_pool_size()
 
         connection_pool = Pool(size=pool_size)
 
-        for device_info in connection_pool.imap(self.fetch_asset_details, self.fetch_asset_ids(), maxsize=pool_size):
+        full_sync = not self.incremental_sync or self.is_full_sync_due()
+        if self.incremental_sync:
+            self.logger.info("Running the %s sync", "full" if full_sync else "incremental")
+
+        completed = False
+        if self.inventory_api and not self.group_name:
+            inventory_records = self.load_inventory_records(connection_pool, full_sync)
+            if inventory_records is not None:
+                yield from inventory_records
+                completed = True
+        elif self.inventory_api:
+            self.logger.info("Jamf Pro inventory API does not filter by the group, using the classic API")
+
+        if not completed:
+            all_asset_ids = asset_ids = self.fetch_asset_ids()
+            listing_failed = asset_ids is None
+            if listing_failed:
+                all_asset_ids = asset_ids = []
+            report_dates = {}
+            if self.incremental_sync:
+                report_dates = self.fetch_report_dates()
+                if not full_sync:
+                    asset_ids = self.select_changed_assets(asset_ids, report_dates)
+
+            # the devices failed during the previous sync are fetched again, unless they are gone from Jamf
+            queued_ids = set(map(str, get_state_store().get_value(RETRY_QUEUE_NAMESPACE, self.state_key, [])))
+            selected_ids = set(map(str, asset_ids))
+            asset_ids = asset_ids + [
+                asset_id for asset_id in all_asset_ids
+                if str(asset_id) in queued_ids and str(asset_id) not in selected_ids
+            ]
+
+            failed_ids = []
+            yield from self.fetch_assets(connection_pool, asset_ids, report_dates, failed_ids)
+
+            for delay in RETRY_DELAYS:
+                if not failed_ids:
+                    break
+                self.logger.warning("Retrying %s failed devices in %s seconds", len(failed_ids), delay)
+                gevent.sleep(delay)
+                retry_ids, failed_ids = failed_ids, []
+                yield from self.fetch_assets(connection_pool, retry_ids, report_dates, failed_ids)
+
+            if listing_failed:
+                # the queued devices could not be matched against the listing, keep them for the next sync
+                self.logger.warning("Jamf devices were not listed, the retry queue is kept for the next sync")
+            else:
+                self.save_retry_queue(failed_ids)
+            # the failed devices are queued for the next sync, so the full sync is still considered done,
+            # unless the devices were not even listed
+            completed = not listing_failed
+
+        if self.incremental_sync:
+            store = get_state_store()
+            if full_sync and completed:
+                store.set(FULL_SYNC_NAMESPACE, self.state_key, arrow.utcnow().isoformat())
+            store.flush()
+
+        self.log_concurrency_stats()
+
+    def fetch_assets(self, connection_pool, asset_ids, report_dates, failed_ids):
+        """
+        Fetch the details of the devices concurrently, the IDs of the failed devices are added to `failed_ids`
+        """
+        # the details are returned in the order of the IDs
+        details = connection_pool.imap(self.fetch_asset_details, asset_ids, maxsize=connection_pool.size)
+        for asset_id, device_info in zip(asset_ids, details):
             if device_info:
                 yield device_info
+                self.save_report_date(asset_id, report_dates.get(str(asset_id)))
             else:
-                break
+                failed_ids.append(asset_id)
+
+    def save_retry_queue(self, failed_ids):
+        store = get_state_store()
+        if failed_ids:
+            self.logger.error("Failed to fetch %s devices, they will be fetched by the next sync: %s",
+                              len(failed_ids), ', '.join(map(str, failed_ids)))
+            store.set(RETRY_QUEUE_NAMESPACE, self.state_key, failed_ids)
+        else:
+            store.delete(RETRY_QUEUE_NAMESPACE, self.state_key)
+        store.flush()
 
     def fetch_asset_ids(self):
         """
         This method is used to retrieve the ids of assets in Casper
+        :return: None if the IDs could not be loaded, so the failure is not taken for the empty list
         """
         try:
             # print self.ids_url
@@ -168,7 +597,7 @@ class Connector(AssetsConnector):
                 self.logger.error("Error loading assets for group: %r. Please verify the group name is correct.", self.group_name)
             else:
                 self.logger.exception("Error loading IDs from Casper.")
-            return []
+            return None
 
     def fetch_asset_details(self, device_id):
         """
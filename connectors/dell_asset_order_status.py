@@ -1,13 +1,20 @@
 import logging
 import json
 import arrow
+from gevent.pool import Pool
 from lib.connector import AssetsConnector
 from utils.helper_utils import response_to_object
+from utils.token_cache import get_access_token as get_cached_access_token, invalidate_access_token, is_unauthorized
 from requests.exceptions import RequestException
-from typing import Dict, List, Any
+from typing import Dict, Iterator, List, Any
 
 logger = logging.getLogger("connectors/dell_asset_order_status")
 
+# Number of the PO numbers / DP IDs / order numbers searched by the single request
+DEFAULT_SEARCH_CHUNK_SIZE = 50
+
+TOKEN_URL = "https://apigtwb2c.us.dell.com/auth/oauth/v2/token"
+
 
 class Connector(AssetsConnector):
     """
@@ -22,7 +29,9 @@ class Connector(AssetsConnector):
         'is_order_no_country_code': {'order': 4, 'example': 'False', 'default': ""},
         'values': {'order': 5, 'example': ['PO123', 'PO432'], 'default': []},
         'country_code': {'order': 6, 'example': ['US', 'EU', 'IN'], 'default': []},
-        'authorization_settings': {'order': 7, 'default': {}}
+        'authorization_settings': {'order': 7, 'default': {}},
+        'search_chunk_size': {'order': 8, 'example': '50', 'default': ""},
+        'search_concurrency': {'order': 9, 'example': '3', 'default': ""}
     }
 
     def __init__(self, section, settings):
@@ -38,6 +47,11 @@ class Connector(AssetsConnector):
         self.country_code = self.settings.get('country_code', [])
         self.values = self.settings.get('values', [])
         self.authorization_settings = self.settings.get('authorization_settings', {})
+        self.search_chunk_size = max(int(self.settings.get('search_chunk_size') or DEFAULT_SEARCH_CHUNK_SIZE), 1)
+        # Number of the chunks searched at the same time, defaults to the number of workers
+        self.search_concurrency = max(int(self.settings.get('search_concurrency') or self.settings.get('__workers__', 2)), 1)
+        # the chunks of the values the search has failed for, with the errors
+        self.failed_chunks = []
 
     def get_headers(self):
         headers = {
@@ -48,7 +62,7 @@ class Connector(AssetsConnector):
         if self.client_id and self.client_secret:
             if not self.access_token or round(arrow.utcnow().float_timestamp) > self.dell_expires_in:
                 self.get_access_token(self.client_id, self.client_secret)
-                headers['Authorization'] = f'Bearer {self.access_token}'
+            headers['Authorization'] = f'Bearer {self.access_token}'
         elif self.authorization_settings.get('Authorization'):
             headers['Authorization'] = self.authorization_settings['Authorization']
         else:
@@ -56,24 +70,50 @@ class Connector(AssetsConnector):
         return headers
 
     def get_access_token(self, client_key: str, client_secret: str):
-        base_url = "https://apigtwb2c.us.dell.com/auth/oauth/v2/token"
+        base_url = TOKEN_URL
         grant_type = "client_credentials"
         url = f"{base_url}?grant_type={grant_type}&client_id={client_key}&client_secret={client_secret}"
         basic_auth_headers = {
             'Content-Type': 'application/x-www-form-urlencoded'
         }
 
-        json_response = self.post(url, data={},
-                                  headers=basic_auth_headers, post_as_json=False)
+        def request_token():
+            json_response = self.post(url, data={},
+                                      headers=basic_auth_headers, post_as_json=False)
+            dict_response = response_to_object(json_response.text)
+            return dict_response.get('access_token', ''), int(dict_response.get('expires_in', 3600))
 
-        dict_response = response_to_object(json_response.text)
-        self.access_token = dict_response.get('access_token', '')
-        self.dell_expires_in = round(arrow.utcnow().float_timestamp) + int(dict_response.get('expires_in', 3600))
+        self.access_token, expires_in = get_cached_access_token(base_url, client_key, client_secret, request_token)
+        self.dell_expires_in = round(arrow.utcnow().float_timestamp) + expires_in
         self.logger.info("Access token acquired")
 
-    def get_body_data(self) -> Dict[str, List[Dict[str, List[str]]]]:
+    def reset_access_token(self, rejected_token: str):
+        """
+        Forget the token rejected by the API, so the next call requests the new one instead of reusing the cached one.
+        The concurrent chunks rejected with the same token reset it only once
+        """
+        if self.access_token != rejected_token:
+            return
+        invalidate_access_token(TOKEN_URL, self.client_id)
+        self.access_token = ""
+        self.dell_expires_in = 0
+
+    def post_search(self, body: Dict[str, Any]):
+        access_token = self.access_token
+        try:
+            return self.post(self.get_sales_order_status_api, data=body)
+        except RequestException as exc:
+            if not (self.client_id and self.client_secret and is_unauthorized(exc)):
+                raise
+            self.logger.warning("Access token has been rejected, requesting the new one")
+            self.reset_access_token(access_token)
+            return self.post(self.get_sales_order_status_api, data=body)
+
+    def get_values(self) -> List[str]:
+        return self.values if isinstance(self.values, list) else json.loads(self.values)
+
+    def get_body_data(self, values: List[str]) -> Dict[str, List[Dict[str, List[str]]]]:
         search_parameter = []
-        values = self.values if isinstance(self.values, list) else json.loads(self.values)
         country_code = self.country_code if isinstance(self.country_code, list) else json.loads(self.country_code)
         if self.is_po_numbers:
             search_parameter.append({
@@ -102,61 +142,100 @@ class Connector(AssetsConnector):
 
         return body
 
-    def get_orders(self) -> Dict[str, Any]:
-        body = self.get_body_data()
-        response = response_to_object(self.post(self.get_sales_order_status_api, data=body).text)
-        self.logger.info("Order details fetched.")
+    def search_orders(self, values: List[str]) -> Dict[str, Any]:
+        body = self.get_body_data(values)
+        try:
+            response = response_to_object(self.post_search(body).text)
+        except RequestException as req_err:
+            # the other chunks are still processed, the failure is reported once all of them are done
+            self.logger.warning(f"Failed to fetch order information of {len(values)} values starting with {values[0]}: {req_err} ")
+            self.failed_chunks.append((values, req_err))
+            return {}
+        self.logger.info(f"Order details of {len(values)} values fetched.")
         return response
 
+    def get_orders(self):
+        """
+        Search the configured values by chunks, the chunks are searched concurrently
+        and every response is yielded as soon as it is received.
+        If any chunk has failed, RequestException is raised after the responses of the other chunks are yielded
+        """
+        self.failed_chunks = []
+        values = self.get_values()
+        chunks = [values[i:i + self.search_chunk_size] for i in range(0, len(values), self.search_chunk_size)]
+
+        # get the access token before the concurrent calls, it is reused by all the chunks
+        self.get_headers()
+
+        connection_pool = Pool(size=self.search_concurrency)
+        responses = connection_pool.imap_unordered(self.search_orders, chunks, maxsize=self.search_concurrency)
+        try:
+            for response in responses:
+                yield response
+        finally:
+            responses.kill()
+            connection_pool.kill()
+
+        if self.failed_chunks:
+            failed_values = sum(len(chunk) for chunk, _ in self.failed_chunks)
+            raise RequestException(
+                f"Order information of {failed_values} of {len(values)} values was not fetched, "
+                f"{len(self.failed_chunks)} of {len(chunks)} searches failed, the last error: {self.failed_chunks[-1][1]}"
+            )
+
     @staticmethod
-    def attach_list_header_details(order: Dict, final_dict: Dict, ignore_keys: Any):
-        final_dict.update({key: value for key, value in order.items() if key not in ignore_keys})
-
-    def process_product_info(self, order: Dict, product_info: Dict, final_dict: Dict) -> List[Dict]:
-        results = []
-        if 'serviceTags' in product_info:
-            self.attach_list_header_details(product_info, final_dict, ignore_keys=['serviceTags'])
-            for serial_number in product_info['serviceTags']:
-                final_dict['serialnumber'] = serial_number
-                # Attach shipping information to final dict from order information.
-                if 'shipToInformation' in order:
-                    final_dict['shipToInformation'] = order['shipToInformation']
-                    # Copy original contents as there may be more than one serial number in an order
-                    results.append(final_dict.copy())
-        return results
-
-    def attach_dell_order_details(self, dell_orders: Dict, final_dict: Dict, ignore_keys: List) -> List[Dict]:
-        results = []
+    def build_layer(source: Dict, ignore_keys: Any, base: Dict = None) -> Dict:
+        """
+        Return the new dict of the base layer updated with the fields of the source, except the ignored ones
+        """
+        layer = dict(base) if base else {}
+        layer.update({key: value for key, value in source.items() if key not in ignore_keys})
+        return layer
+
+    def process_product_info(self, order: Dict, product_info: Dict, order_layer: Dict) -> Iterator[Dict]:
+        if 'serviceTags' not in product_info or 'shipToInformation' not in order:
+            return
+
+        # the fields shared by all the service tags of the product are composed once
+        product_layer = self.build_layer(product_info, ['serviceTags'], base=order_layer)
+        for serial_number in product_info['serviceTags']:
+            # the record is the shallow copy of the product layer, the nested shipping information is referenced
+            record = dict(product_layer)
+            record['serialnumber'] = serial_number
+            record['shipToInformation'] = order['shipToInformation']
+            yield record
+
+    def attach_dell_order_details(self, dell_orders: Dict, header_layer: Dict, ignore_keys: List) -> Iterator[Dict]:
         for order in dell_orders:
-            self.attach_list_header_details(order, final_dict, ignore_keys)
+            order_layer = self.build_layer(order, ignore_keys, base=header_layer)
             if 'productInfo' in order:
                 for product_info in order['productInfo']:
-                    results.extend(self.process_product_info(order, product_info, final_dict))
+                    yield from self.process_product_info(order, product_info, order_layer)
             else:
                 logger.warning("No product information available in Dell Orders.")
-        return results
-
-    def create_dell_response_dict(self, response) -> List[Dict]:
-        results = []
-        for order in response["purchaseOrderDetails"]:
-            output_dict = {}
-            self.attach_list_header_details(order, output_dict, ignore_keys=["dellOrders"])
-            order_info = order.get('dellOrders', [])
-            ignore_keys = ["productInfo", "trackingInformation", "shipToInformation", "purchaseOrderLines"]
-            results.extend(self.attach_dell_order_details(order_info, output_dict, ignore_keys))
-        return results
+
+    def create_dell_response_dict(self, response) -> Iterator[Dict]:
+        """
+        Yield the independent flat record per service tag. The purchase order header, the Dell order and the product
+        layers are built once, every record is the shallow copy of its product layer with the fields of the tag.
+        The records are streamed, only the record being processed by the sync is kept in memory
+        """
+        ignore_keys = ["productInfo", "trackingInformation", "shipToInformation", "purchaseOrderLines"]
+        for order in response.get("purchaseOrderDetails", []):
+            header_layer = self.build_layer(order, ["dellOrders"])
+            yield from self.attach_dell_order_details(order.get('dellOrders', []), header_layer, ignore_keys)
 
     def _load_records(self, *a, **kw):
         if not self.client_id or not self.client_secret:
             self.logger.warning("Missing Client ID or Client Secret. Can not run. Exiting.")
             return
         try:
-            dell_payload = self.get_orders()
+            for dell_payload in self.get_orders():
+                for ready_order_info in self.create_dell_response_dict(dell_payload):
+                    yield ready_order_info
         except RequestException as req_err:
             self.logger.warning(f"Failed to fetch order information: {req_err} ")
             return
-        for ready_order_info in self.create_dell_response_dict(dell_payload):
-            yield ready_order_info
 
     def load_cloud_records(self, credential_details):
         if credential_details:
@@ -164,7 +243,6 @@ class Connector(AssetsConnector):
             self.client_id = inputs.get('client_key')
             self.client_secret = inputs.get('client_secret')
 
-        dell_payload = self.get_orders()
-
-        for ready_order_info in self.create_dell_response_dict(dell_payload):
-            yield ready_order_info
+        for dell_payload in self.get_orders():
+            for ready_order_info in self.create_dell_response_dict(dell_payload):
+                yield ready_order_info
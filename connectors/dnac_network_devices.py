@@ -1,6 +1,8 @@
 from lib.connector import AssetsConnector
 import base64
 import arrow
+from requests.exceptions import RequestException
+from utils.token_cache import UNAUTHORIZED_STATUS, get_access_token as get_cached_access_token, invalidate_access_token, is_unauthorized
 
 
 class Connector(AssetsConnector):
@@ -31,12 +33,25 @@ class Connector(AssetsConnector):
             "Content-Type": "application/json",
         }
 
+    def _get_token_url(self):
+        return f"{self.base_url}/dna/system/api/v1/auth/token"
+
+    def _get_token_client_id(self):
+        return self.username if self.username and self.password else ""
+
+    def _reset_token(self):
+        # the token rejected by the API is not reused from the cache
+        invalidate_access_token(self._get_token_url(), self._get_token_client_id())
+        self.token = ""
+        self.expires_in = 0
+
     def _refresh_token(self):
-        url = f"{self.base_url}/dna/system/api/v1/auth/token"
+        url = self._get_token_url()
 
         headers = {"Content-Type": "application/json", "Accept": "application/json"}
 
         if self.username and self.password:
+            client_id, client_secret = self.username, self.password
             basic_auth_value = base64.b64encode(
                 f"{self.username}:{self.password}".encode()
             ).decode("utf-8")
@@ -45,15 +60,29 @@ class Connector(AssetsConnector):
             headers["Authorization"] = self.authorization_settings.get(
                 "Authorization", ""
             )
+            client_id, client_secret = "", headers["Authorization"]
 
-        response = self.post(url, headers=headers, data={})
-        response.raise_for_status()
-        self.token = response.json().get("Token", "")
-        self.expires_in = round(arrow.utcnow().float_timestamp) + 1800
+        def request_token():
+            response = self.post(url, headers=headers, data={})
+            response.raise_for_status()
+            # the token is valid for 1 hour, refresh it in 30 minutes
+            return response.json().get("Token", ""), 1800
+
+        self.token, expires_in = get_cached_access_token(url, client_id, client_secret, request_token)
+        self.expires_in = round(arrow.utcnow().float_timestamp) + expires_in
 
     def get_network_devices(self, limit: int, offset: int):
         url = f"{self.base_url}/dna/intent/api/v1/network-device?limit={limit}&offset={offset}"
-        response = self.get(url, headers=self.get_headers())
+        try:
+            response = self.get(url, headers=self.get_headers())
+            rejected = response.status_code == UNAUTHORIZED_STATUS
+        except RequestException as exc:
+            if not is_unauthorized(exc):
+                raise
+            rejected = True
+        if rejected:
+            self._reset_token()
+            response = self.get(url, headers=self.get_headers())
         response.raise_for_status()
         return response.json()
 
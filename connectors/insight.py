@@ -1,13 +1,40 @@
 import os
 import base64
+import json
 import logging
 import arrow
+from gevent.pool import Pool
+from constants import TRUE_VALUES
 from lib.connector import AssetsConnector
+from requests.exceptions import HTTPError, RetryError, Timeout
 from utils.helper_utils import response_to_object
+from utils.state_store import get_state_store
+from utils.token_cache import get_access_token as get_cached_access_token, invalidate_access_token, is_unauthorized
 from typing import Dict, List, Any
 
 logger = logging.getLogger("connectors/insight")
 
+TOKEN_URL = 'https://insight-prod.apigee.net/oauth/client_credential/accesstoken?grant_type=client_credentials'
+
+# The Insight API allows a maximum range of 180 days
+MAX_WINDOW_DAYS = 180
+MIN_WINDOW_DAYS = 1
+# The window is widened for the next requests when it returns fewer orders and narrowed when it returns more orders
+SPARSE_WINDOW_ORDERS = 100
+DENSE_WINDOW_ORDERS = 2000
+
+WINDOW_SIZE_NAMESPACE = 'insight.window_size'
+CHECKPOINTS_NAMESPACE = 'insight.checkpoints'
+RESPONSES_NAMESPACE = 'insight.responses'
+
+# The nested structures of the line items and deliveries that are flattened separately
+FLATTEN_IGNORE_KEYS = ("Delivery", "SerialNumbers", "BillingInformation")
+
+# The windows share the boundary dates, so the orders created on these dates are returned twice.
+# The records are deduplicated on (order number, line number, serial number) taken from the first field present
+ORDER_NUMBER_FIELDS = ("OrderNumber", "SalesOrderNumber", "SalesDocumentNumber")
+LINE_NUMBER_FIELDS = ("LineNumber", "OrderLineNumber", "LineItemNumber")
+
 
 class Connector(AssetsConnector):
     """
@@ -15,13 +42,17 @@ class Connector(AssetsConnector):
     """
     MappingName = 'insight'
     Settings = {
-        'client_id': {'order': 1, 'example': '', 'default': ""},
+        'client_id': {'order': 1, 'example': '9668126,9668127', 'default': ""},
         'client_key': {'order': 2, 'example': '', 'default': ""},
         'client_secret': {'order': 3, 'example': '******', 'default': ""},
         'order_creation_date_from': {'order': 4, 'example': 'YYYY-MM-DD', 'default': ""},
         'order_creation_date_to': {'order': 5, 'example': 'YYYY-MM-DD', 'default': arrow.now().format('YYYY-MM-DD')},
         'tracking_data': {'order': 6, 'example': 'X', 'default': ""},
-        'insight_url': {'order': 7, 'example': 'https://example.com/GetStatus', 'default': ""}
+        'insight_url': {'order': 7, 'example': 'https://example.com/GetStatus', 'default': ""},
+        'window_concurrency': {'order': 8, 'example': '3', 'default': ""},
+        'resume_backfill': {'order': 9, 'example': 'True', 'default': "True"},
+        'cache_freeze_days': {'order': 10, 'example': '90', 'default': ""},
+        'cache_refresh': {'order': 11, 'example': 'False', 'default': "False"}
     }
 
     def __init__(self, section, settings):
@@ -42,7 +73,9 @@ class Connector(AssetsConnector):
         # Authentication credentials - prioritize environment variables
         self.client_key = os.environ.get('INSIGHT_CLIENT_KEY') or self.settings.get('client_key', '')
         self.client_secret = os.environ.get('INSIGHT_CLIENT_SECRET') or self.settings.get('client_secret', '')
-        self.client_id = os.environ.get('INSIGHT_CLIENT_ID') or self.settings.get('client_id', '')
+        # Several client IDs can be given separated by commas, they are synced concurrently within the same run
+        client_ids = os.environ.get('INSIGHT_CLIENT_ID') or self.settings.get('client_id', '')
+        self.client_ids = [client_id.strip() for client_id in str(client_ids).split(',') if client_id.strip()]
         self.tracking_data = os.environ.get('INSIGHT_TRACKING_DATA') or self.settings.get('tracking_data', '')
 
         # Date logic with environment variable priority
@@ -58,8 +91,41 @@ class Connector(AssetsConnector):
             
         self.order_date_from = order_date_from
         self.order_date_to = order_date_to
+
+        # Number of date windows requested from Insight at the same time, defaults to the number of workers
+        window_concurrency = os.environ.get('INSIGHT_WINDOW_CONCURRENCY') or self.settings.get('window_concurrency', '')
+        self.window_concurrency = max(int(window_concurrency or self.settings.get('__workers__', 2)), 1)
+
+        # Start with the window size that worked well during the previous run, the largest allowed one otherwise.
+        # The state of the windows is kept per client ID, the clients differ in the density of the orders
+        self.window_size = {
+            client_id: get_state_store().get_value(WINDOW_SIZE_NAMESPACE, client_id, MAX_WINDOW_DAYS)
+            for client_id in self.client_ids
+        }
+        # The windows of this size or larger have timed out during this run, never widen up to them again
+        self.failed_window_size = {client_id: MAX_WINDOW_DAYS + 1 for client_id in self.client_ids}
+
+        # The windows completed by the previous failed run of the same date range are skipped
+        resume_backfill = os.environ.get('INSIGHT_RESUME_BACKFILL') or self.settings.get('resume_backfill', 'True')
+        self.resume_backfill = resume_backfill in TRUE_VALUES
+        self.completed_windows = {
+            client_id: self.load_checkpoints(client_id) if self.resume_backfill else []
+            for client_id in self.client_ids
+        }
+
+        # The windows ended more than `cache_freeze_days` ago are not expected to change anymore,
+        # their responses are cached locally and served from the cache unless the refresh is forced
+        cache_freeze_days = os.environ.get('INSIGHT_CACHE_FREEZE_DAYS') or self.settings.get('cache_freeze_days', '')
+        self.cache_freeze_days = int(cache_freeze_days) if cache_freeze_days else None
+        cache_refresh = os.environ.get('INSIGHT_CACHE_REFRESH') or self.settings.get('cache_refresh', 'False')
+        self.cache_refresh = cache_refresh in TRUE_VALUES
+        self.cached_windows = {client_id: self.load_cached_windows(client_id) for client_id in self.client_ids}
+
+        self.seen_record_keys = set()
+        self.suppressed_duplicates = 0
         
-        logger.info(f"Insight connector initialized with date range: {self.order_date_from} to {self.order_date_to}")
+        logger.info(f"Insight connector initialized with date range: {self.order_date_from} to {self.order_date_to} "
+                    f"for the client IDs: {', '.join(self.client_ids)}")
 
     def get_headers(self):
         if round(arrow.utcnow().float_timestamp) > self.insight_expires_in:
@@ -71,18 +137,32 @@ class Connector(AssetsConnector):
         # Create the base64 client_id and client_secret token and grab an Access Token
         token = f"{client_key}:{client_secret}"
         base64_token = base64.b64encode(token.encode()).decode()
-        token_url = 'https://insight-prod.apigee.net/oauth/client_credential/accesstoken?grant_type=client_credentials'
+        token_url = TOKEN_URL
         basic_auth_headers = {
             'Authorization': f'Basic {base64_token}',
             'Content-Type': 'application/x-www-form-urlencoded'
         }
 
-        json_response = self.post(token_url, data={}, headers=basic_auth_headers, post_as_json=False)
-        dict_response = response_to_object(json_response.text)
 
-        self.access_token = dict_response.get('access_token', '')
-        # expires in 1hr according to docs
-        self.insight_expires_in = round(arrow.utcnow().float_timestamp) + int(dict_response.get('expires_in', 3599))
+        def request_token():
+            json_response = self.post(token_url, data={}, headers=basic_auth_headers, post_as_json=False)
+            dict_response = response_to_object(json_response.text)
+            # expires in 1hr according to docs
+            return dict_response.get('access_token', ''), int(dict_response.get('expires_in', 3599))
+
+        self.access_token, expires_in = get_cached_access_token(token_url, client_key, client_secret, request_token)
+        self.insight_expires_in = round(arrow.utcnow().float_timestamp) + expires_in
+
+    def reset_access_token(self, rejected_token: str):
+        """
+        Forget the token rejected by the API, so the next call requests the new one instead of reusing the cached one.
+        The concurrent windows rejected with the same token reset it only once
+        """
+        if self.access_token != rejected_token:
+            return
+        invalidate_access_token(TOKEN_URL, self.client_key)
+        self.access_token = ""
+        self.insight_expires_in = 0
 
     @staticmethod
     def generate_dates_range(start: str, end: str, interval: int):
@@ -100,88 +180,332 @@ class Connector(AssetsConnector):
 
         return dates_range
 
+    def get_checkpoints_key(self, client_id: str) -> str:
+        return f"{client_id}:{self.tracking_data}:{self.order_date_from}:{self.order_date_to}"
+
+    def load_checkpoints(self, client_id: str) -> list:
+        completed_windows = get_state_store().get_value(CHECKPOINTS_NAMESPACE, self.get_checkpoints_key(client_id), [])
+        if completed_windows:
+            logger.info(f"Resuming the sync of {self.order_date_from} - {self.order_date_to} for the client {client_id}, "
+                        f"{len(completed_windows)} windows are already completed")
+        return sorted(tuple(window) for window in completed_windows)
+
+    def save_checkpoint(self, client_id: str, dates_window):
+        """
+        Remember the window as completed, so the rerun after the failure does not fetch it again
+        """
+        self.completed_windows[client_id].append(tuple(dates_window))
+        store = get_state_store()
+        store.set(CHECKPOINTS_NAMESPACE, self.get_checkpoints_key(client_id), self.completed_windows[client_id])
+        store.flush()
+
+    def clear_checkpoints(self, client_id: str):
+        store = get_state_store()
+        store.delete(CHECKPOINTS_NAMESPACE, self.get_checkpoints_key(client_id))
+        store.flush()
+
+    def get_cache_prefix(self, client_id: str) -> str:
+        return f"{client_id}:{self.tracking_data}:"
+
+    def load_cached_windows(self, client_id: str) -> Dict[str, str]:
+        """
+        Return the map of the start date to the end date of the cached windows
+        """
+        if self.cache_freeze_days is None or self.cache_refresh:
+            return {}
+
+        prefix = self.get_cache_prefix(client_id)
+        cached_windows = {}
+        for key in get_state_store().keys(RESPONSES_NAMESPACE, prefix):
+            date_from, date_to = key[len(prefix):].split(':')
+            cached_windows[date_from] = max(date_to, cached_windows.get(date_from, date_to))
+        return cached_windows
+
+    def is_window_frozen(self, dates_window) -> bool:
+        if self.cache_freeze_days is None:
+            return False
+        return arrow.get(dates_window[1]) <= arrow.utcnow().floor('day').shift(days=-self.cache_freeze_days)
+
+    def get_cached_response(self, client_id: str, dates_window):
+        if self.cache_refresh or not self.is_window_frozen(dates_window):
+            return None
+        return get_state_store().get_value(RESPONSES_NAMESPACE, self.get_cache_prefix(client_id) + ':'.join(dates_window))
+
+    def cache_response(self, client_id: str, dates_window, response):
+        if self.is_window_frozen(dates_window) and isinstance(response, dict):
+            get_state_store().set(RESPONSES_NAMESPACE, self.get_cache_prefix(client_id) + ':'.join(dates_window), response)
+
+    def skip_completed(self, client_id: str, date_from):
+        """
+        Return the first date not covered by the completed windows and the end of the gap starting there
+        """
+        gap_end = None
+        for completed_from, completed_to in sorted(self.completed_windows[client_id]):
+            completed_from, completed_to = arrow.get(completed_from), arrow.get(completed_to)
+            if completed_from <= date_from < completed_to:
+                date_from = completed_to
+            elif completed_from > date_from:
+                gap_end = completed_from
+                break
+        return date_from, gap_end
+
+    def iterate_windows(self, client_id: str):
+        """
+        Lazily cut the date range into the windows, every next window takes the size adjusted by the previous responses.
+        The windows completed by the previous run are skipped
+        """
+        end = arrow.get(self.order_date_to)
+        date_from = arrow.get(self.order_date_from)
+        while date_from < end:
+            date_from, gap_end = self.skip_completed(client_id, date_from)
+            if date_from >= end:
+                break
+
+            date_to = min(date_from.shift(days=self.window_size[client_id]), end)
+            if gap_end is not None:
+                date_to = min(date_to, gap_end)
+
+            # prefer the boundaries of the cached window, so it is served from the cache
+            cached_date_to = self.cached_windows[client_id].get(date_from.format("YYYY-MM-DD"))
+            if cached_date_to and arrow.get(cached_date_to) <= end and (gap_end is None or arrow.get(cached_date_to) <= gap_end):
+                date_to = arrow.get(cached_date_to)
+
+            yield date_from.format("YYYY-MM-DD"), date_to.format("YYYY-MM-DD")
+            date_from = date_to
+
+    def iterate_client_windows(self):
+        """
+        Interleave the windows of all the client IDs, so the clients are fetched side by side by the same pool
+        """
+        client_windows = [(client_id, self.iterate_windows(client_id)) for client_id in self.client_ids]
+        while client_windows:
+            for client_id, windows in list(client_windows):
+                dates_window = next(windows, None)
+                if dates_window is None:
+                    client_windows.remove((client_id, windows))
+                    continue
+                yield client_id, dates_window
+
+    @staticmethod
+    def is_window_too_large(exc: Exception) -> bool:
+        if isinstance(exc, (Timeout, RetryError)):
+            return True
+        return isinstance(exc, HTTPError) and exc.response is not None and exc.response.status_code >= 500
+
+    @staticmethod
+    def count_orders(response) -> int:
+        if not isinstance(response, dict):
+            return 0
+        return sum(len(orders.get('Order', [])) for orders in response.get('StatusOrderResponse', []))
+
+    def adjust_window_size(self, client_id: str, window_days: int, orders_count: int):
+        window_size = self.window_size[client_id]
+        if orders_count > DENSE_WINDOW_ORDERS:
+            self.window_size[client_id] = max(min(window_size, window_days // 2), MIN_WINDOW_DAYS)
+        elif orders_count < SPARSE_WINDOW_ORDERS and window_days >= window_size:
+            self.window_size[client_id] = min(window_size * 2, self.failed_window_size[client_id] - 1, MAX_WINDOW_DAYS)
+
+    def fetch_client_window(self, client_window) -> tuple:
+        client_id, dates_window = client_window
+        return client_id, self.fetch_window(client_id, dates_window)
+
+    def split_window(self, client_id: str, dates_window, window_days: int) -> list:
+        """
+        Fetch the halves of the window instead of the window itself
+        """
+        date_from, date_to = dates_window
+        middle = arrow.get(date_from).shift(days=window_days // 2).format("YYYY-MM-DD")
+        self.window_size[client_id] = max(min(self.window_size[client_id], window_days // 2), MIN_WINDOW_DAYS)
+        return self.fetch_window(client_id, (date_from, middle)) + self.fetch_window(client_id, (middle, date_to))
+
+    def fetch_window(self, client_id: str, dates_window) -> list:
+        """
+        Fetch the window, if it times out or its payload is oversized split it in half and fetch the halves instead.
+        The windows not smaller than the size already failed for the client are split without the request
+        :return: the list of the fetched windows with their responses
+        """
+        date_from, date_to = dates_window
+        cached_response = self.get_cached_response(client_id, dates_window)
+        if cached_response is not None:
+            logger.info(f"Window {date_from} - {date_to} of the client {client_id} is served from the local cache")
+            return [(dates_window, cached_response)]
+
+        window_days = (arrow.get(date_to) - arrow.get(date_from)).days
+        if window_days >= self.failed_window_size[client_id] and window_days > MIN_WINDOW_DAYS:
+            # the window was generated before the same size failed, it is split without waiting for another timeout
+            logger.info(f"Window {date_from} - {date_to} of the client {client_id} is not smaller than the failed one, splitting it in half")
+            return self.split_window(client_id, dates_window, window_days)
+
+        try:
+            response = self.request_window(client_id, dates_window)
+        except Exception as exc:
+            if window_days <= MIN_WINDOW_DAYS or not self.is_window_too_large(exc):
+                raise
+
+            self.failed_window_size[client_id] = min(self.failed_window_size[client_id], window_days)
+            logger.warning(f"Window {date_from} - {date_to} of the client {client_id} failed ({exc}), splitting it in half")
+            return self.split_window(client_id, dates_window, window_days)
+
+        orders_count = self.count_orders(response)
+        if orders_count > DENSE_WINDOW_ORDERS and window_days > MIN_WINDOW_DAYS:
+            # the oversized payload is not kept, the halves are processed instead
+            logger.info(f"Window {date_from} - {date_to} of the client {client_id} returned {orders_count} orders, splitting it in half")
+            del response
+            return self.split_window(client_id, dates_window, window_days)
+
+        self.adjust_window_size(client_id, window_days, orders_count)
+        self.cache_response(client_id, dates_window, response)
+        return [(dates_window, response)]
+
+    def request_window(self, client_id: str, dates_window):
+        date_from, date_to = dates_window
+        # The call must have a body to return a 200 response
+        body_data = {"MT_Status2Request": {
+            "StatusRequest": [
+                {
+                    "ClientID": client_id,
+                    "TrackingData": self.tracking_data,
+                    "OrderCreationDateFrom": date_from,
+                    "OrderCreationDateTo": date_to
+                }
+            ]
+        }}
+
+        # The GET method does not allow for data so POST is being used here
+        access_token = self.access_token
+        try:
+            response = self.post(self.get_sales_order_status_api, data=body_data)
+        except HTTPError as exc:
+            if not is_unauthorized(exc):
+                raise
+            logger.warning(f"Access token has been rejected for the client {client_id}, requesting the new one")
+            self.reset_access_token(access_token)
+            response = self.post(self.get_sales_order_status_api, data=body_data)
+        return response_to_object(response.text)
+
     def get_orders(self):
+        """
+        Yield the client ID and the response for every window of every client ID
+        """
         # The Insight API allows a maximum range of 180 days, so we need to paginate on the main date range.
-        # The Insight API is also very slow, so we chose an interval of 60 days therefore we're sure to get a response.
-        dates_range = self.generate_dates_range(self.order_date_from, self.order_date_to, 60)
-
-        for date_from, date_to in dates_range:
-            # The call must have a body to return a 200 response
-            body_data = {"MT_Status2Request": {
-                "StatusRequest": [
-                    {
-                        "ClientID": self.client_id,
-                        "TrackingData": self.tracking_data,
-                        "OrderCreationDateFrom": date_from,
-                        "OrderCreationDateTo": date_to
-                    }
-                ]
-            }}
-
-            # The GET method does not allow for data so POST is being used here
-            response = response_to_object(self.post(self.get_sales_order_status_api, data=body_data).text)
-            yield response
+        # The Insight API is also very slow, so the window size adapts: the windows timing out are split in half,
+        # the sparse windows make the next ones wider, and the size is remembered for the next run.
 
-    @staticmethod
-    def attach_order_headers(order_header: List[Dict[str, Any]], final_dict: Dict[str, Any]):
-        final_dict.update({key: value for (key, value) in order_header[0].items()})
+        # get the access token before the concurrent calls, so they do not request it all at once.
+        # The token is issued for the client key and shared by all the client IDs
+        self.get_headers()
+
+        # The windows of all the clients are fetched concurrently and each response is processed as soon as it is received
+        connection_pool = Pool(size=self.window_concurrency)
+        windows = connection_pool.imap_unordered(self.fetch_client_window, self.iterate_client_windows(), maxsize=self.window_concurrency)
+        try:
+            for client_id, responses in windows:
+                for dates_window, response in responses:
+                    yield client_id, response
+                    # the records of the window are processed once the next response is requested
+                    if self.resume_backfill:
+                        self.save_checkpoint(client_id, dates_window)
+        finally:
+            # do not leave the requests of the other windows running if the sync has failed
+            windows.kill()
+            connection_pool.kill()
+
+        store = get_state_store()
+        for client_id in self.client_ids:
+            if self.resume_backfill:
+                self.clear_checkpoints(client_id)
+
+            logger.info(f"Insight window size of the client {client_id} for the next run: {self.window_size[client_id]} days")
+            store.set(WINDOW_SIZE_NAMESPACE, client_id, self.window_size[client_id])
+        store.flush()
 
     @staticmethod
-    def attach_order_tracking(order_tracking_info: List[Dict[str, Any]],
-                              serial_number: str,
-                              final_dict: Dict[str, Any]):
+    def build_tracking_index(order_tracking_info: List[Dict[str, Any]]) -> Dict[Any, Dict[str, Any]]:
+        """
+        Merge the tracking entries of the order per serial number once, instead of scanning all of them for every serial
+        """
+        tracking_index = {}
         for tracking in order_tracking_info:
-            if 'SerialNumber' in tracking and tracking['SerialNumber'] == serial_number:
-                final_dict.update({key: tracking[key] for key in tracking.keys()})
-
-    def attach_order_line_items_and_tracking(self, order_line_items: Dict[str, Any],
-                                             order_tracking_info: List[Dict[str, Any]],
-                                             final_dict: Dict[str, Any],
-                                             ignore_keys: List[str]):
-
-        for order_item in order_line_items['OrderLineItems']:
-            final_dict.update({key: value for (key, value) in order_item.items() if key not in ignore_keys})
-            if "Delivery" in order_item:
-                for delivery in order_item['Delivery']:
-                    final_dict.update({key: delivery[key] for key in delivery.keys() if key not in ignore_keys})
-
-                    if "SerialNumbers" in delivery:
-                        for serial_number_dict in delivery['SerialNumbers']:
-                            if isinstance(serial_number_dict['SerialNumber'], int):
-                                serial_number = serial_number_dict['SerialNumber']
-                            else:
-                                serial_number = serial_number_dict['SerialNumber'].strip()
-                                final_dict['SerialNumber'] = serial_number
-
-                            self.attach_order_tracking(order_tracking_info, serial_number, final_dict)
-                            if 'BillingInformation' in delivery:
-                                if len(delivery['BillingInformation']) == 1:
-                                    final_dict.update(
-                                        {key: value for (key, value) in delivery['BillingInformation'][0].items()})
-                                    yield final_dict
-                                else:
-                                    logger.warning(
-                                        "Billing Information not added to dict as only one is expected per item in "
-                                        "Order line item.")
+            if 'SerialNumber' in tracking:
+                tracking_index.setdefault(tracking['SerialNumber'], {}).update(tracking)
+        return tracking_index
+
+    @staticmethod
+    def flatten_order(order: Dict[str, Any]):
+        """
+        Yield the independent flat record per serial number of the order. Every record is composed of the layers
+        built once per order, line item and delivery: header, line item, delivery, tracking of the serial and billing
+        """
+        order_header = order.get('OrderHeader', [])
+        header_layer = dict(order_header[0]) if order_header else {}
+        tracking_index = Connector.build_tracking_index(order.get('Tracking', []))
+
+        for order_item in order.get('OrderLineItems', []):
+            line_layer = {**header_layer, **{key: value for (key, value) in order_item.items() if key not in FLATTEN_IGNORE_KEYS}}
+
+            for delivery in order_item.get('Delivery', []):
+                if not delivery.get('SerialNumbers'):
+                    continue
+
+                billing_information = delivery.get('BillingInformation')
+                if billing_information is None:
+                    continue
+                if len(billing_information) != 1:
+                    logger.warning("Billing Information not added to dict as only one is expected per item in Order line item.")
+                    continue
+
+                delivery_layer = {**line_layer, **{key: value for (key, value) in delivery.items() if key not in FLATTEN_IGNORE_KEYS}}
+                billing_layer = billing_information[0]
+
+                for serial_number_dict in delivery['SerialNumbers']:
+                    serial_number = serial_number_dict['SerialNumber']
+                    if not isinstance(serial_number, int):
+                        serial_number = serial_number.strip()
+
+                    record = dict(delivery_layer)
+                    record['SerialNumber'] = serial_number
+                    tracking = tracking_index.get(serial_number)
+                    if tracking:
+                        record.update(tracking)
+                    record.update(billing_layer)
+                    yield record
+
+    @staticmethod
+    def get_record_key(client_id: str, record: Dict[str, Any]):
+        order_number = next((record[field] for field in ORDER_NUMBER_FIELDS if record.get(field) is not None), None)
+        if order_number is None:
+            # no known identity of the order, only the exactly identical records are duplicates
+            return client_id, json.dumps(record, sort_keys=True, default=str)
+
+        line_number = next((record[field] for field in LINE_NUMBER_FIELDS if record.get(field) is not None), None)
+        return client_id, order_number, line_number, record.get('SerialNumber')
+
+    def is_duplicate(self, client_id: str, record: Dict[str, Any]) -> bool:
+        record_key = self.get_record_key(client_id, record)
+        if record_key in self.seen_record_keys:
+            self.suppressed_duplicates += 1
+            return True
+
+        self.seen_record_keys.add(record_key)
+        return False
 
     def create_insight_response_dict(self, response):
         for orders in response["StatusOrderResponse"]:
             for order in orders['Order']:
-                order_header = order.get('OrderHeader', [])
-                order_tracking_info = order.get('Tracking', [])
-                ignore_keys = ["Delivery", "SerialNumbers", "BillingInformation"]
-                output_dict = {}
-
-                self.attach_order_headers(order_header, output_dict)
-                items = self.attach_order_line_items_and_tracking(order, order_tracking_info, output_dict, ignore_keys)
-                for result in items:
-                    yield result
+                yield from self.flatten_order(order)
 
     def _load_records(self, *a, **kw):
         if not self.client_key or not self.client_secret:
             self.logger.warning("Missing Client Key or Client Secret. Can not run. Exiting.")
             return
 
-        for payload in self.get_orders():
+        if not self.client_ids:
+            self.logger.warning("Missing Client ID. Can not run. Exiting.")
+            return
+
+        for client_id, payload in self.get_orders():
             for ready_order_info in self.create_insight_response_dict(payload):
-                yield ready_order_info
+                if not self.is_duplicate(client_id, ready_order_info):
+                    yield ready_order_info
+
+        logger.info(f"Suppressed {self.suppressed_duplicates} duplicate records returned by the overlapping windows")
@@ -5,6 +5,7 @@ import traceback
 from typing import Optional, Dict
 
 from constants import TRUE_VALUES
+from converters import location
 from lib.api_caller import ConfigurableExternalAPICaller
 from lib.aws_iam import AWSIAM
 from lib.connector import BaseConnector
@@ -481,6 +482,39 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
 
         return access_token
 
+    def get_oomnitza_bootstrap_requirements(self) -> Dict[str, tuple]:
+        """
+        Declare the independent calls to Oomnitza required before the sync can start,
+        they are issued concurrently by the Oomnitza connector, see OomnitzaConnector.bootstrap.
+        The locations of the location converter are the only Oomnitza data the generic managed sync looks up,
+        they are handed over to the converter, see `use_oomnitza_bootstrap_results`
+        """
+        requirements = {}
+        if self.uses_location_converter():
+            requirements['locations'] = ('get_location_mappings', location.DEFAULT_FIELD, location.DEFAULT_LABEL)
+        return requirements
+
+    def use_oomnitza_bootstrap_results(self, results: dict):
+        if 'locations' in results:
+            location.preload(location.DEFAULT_FIELD, location.DEFAULT_LABEL, results['locations'])
+
+    def uses_location_converter(self) -> bool:
+        return any(
+            str(mapping.get('converter', '')).split('|')[0] == 'location'
+            for mapping in self.field_mappings.values() if isinstance(mapping, dict)
+        )
+
+    def prepare_oomnitza_for_sync(self) -> dict:
+        """
+        Switch the Oomnitza connector to the token of the user the sync happens on behalf of and run the bootstrap calls.
+        The token check itself is folded into the first bootstrap call instead of the separate AuthTest round trip.
+        The token lookup cannot join the bootstrap calls, all of them are made with the token it returns
+        """
+        oomnitza_access_token = self.get_oomnitza_auth_for_sync()
+        self.OomnitzaConnector.settings['api_token'] = oomnitza_access_token
+        self.OomnitzaConnector.authenticate(deferred=True)
+        return self.OomnitzaConnector.bootstrap(self.get_oomnitza_bootstrap_requirements())
+
     def get_detail_of_item(self, list_response_item, iam_credentials: Optional[dict] = None):
         if self.detail_behavior:
             result_control = self.detail_behavior.get('result', '')
@@ -661,9 +695,7 @@ class Connector(ConfigurableExternalAPICaller, BaseConnector):
         )
 
         # NOTE: The managed sync happen on behalf of a specific user that is defined separately
-        oomnitza_access_token = self.get_oomnitza_auth_for_sync()
-        self.OomnitzaConnector.settings['api_token'] = oomnitza_access_token
-        self.OomnitzaConnector.authenticate()
+        self.use_oomnitza_bootstrap_results(self.prepare_oomnitza_for_sync())
 
         try:
             iam_roles = self.inputs_from_cloud.get('iam_roles', {}).get('value')
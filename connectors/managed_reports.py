@@ -1,12 +1,29 @@
+import gzip
+import hashlib
 import os
-import sqlite3
-from contextlib import contextmanager
+import shutil
 
 import arrow
+from gevent.pool import Pool
+from requests.exceptions import RequestException
 
 from connectors.managed import Connector as ManagedConnector
 from constants import TRUE_VALUES
 from lib.error import ConfigError
+from utils.state_store import StateStore, get_state_store
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_ATTEMPTS = 3
+
+# the folder inside the reports folder keeping the single copy of every distinct report content
+REPORT_OBJECTS_FOLDER = '.objects'
+REPORT_MANIFEST_NAMESPACE = 'managed_reports.manifest'
+
+
+class DownloadIntegrityError(Exception):
+    """
+    The downloaded file does not match the expected size or checksum
+    """
 
 
 class PersistentStateKeeper:
@@ -15,49 +32,26 @@ class PersistentStateKeeper:
     in some persistent storage
     """
 
-    def __init__(self, data_source_type, data_source_id):
+    def __init__(self, data_source_type, data_source_id, store: StateStore = None):
         self.data_source_type = data_source_type
         self.data_source_id = data_source_id
-        # create the table to keep the info about the processed media files
-        with self.connection_manager() as db_connection:
-            cursor = db_connection.cursor()
-            cursor.execute(
-                "create table if not exists `media_storage_state` "
-                "(`data_source_type` text, `data_source_id` text, `creation_date` int, "
-                "primary key (`data_source_type`, `data_source_id`))")
-
-    @staticmethod
-    def get_db_name():
-        return 'state.db'
-
-    @contextmanager
-    def connection_manager(self):
-        connection = sqlite3.connect(self.get_db_name())
-        try:
-            yield connection
-            connection.commit()
-        except:
-            connection.rollback()
-            raise
-        finally:
-            connection.close()
+        self.store = store or get_state_store()
 
     def mark_as_processed(self, creation_date: int):
-        with self.connection_manager() as db_connection:
-            cursor = db_connection.cursor()
-            cursor.execute(f"replace into `media_storage_state` (`data_source_type`,`data_source_id`,`creation_date`) values (?,?,?)",
-                           (self.data_source_type, self.data_source_id, creation_date))
+        self.store.write(
+            "replace into `media_storage_state` (`data_source_type`,`data_source_id`,`creation_date`) values (?,?,?)",
+            (self.data_source_type, self.data_source_id, creation_date)
+        )
 
     def get_last_processed(self) -> int:
-        with self.connection_manager() as db_connection:
-            cursor = db_connection.cursor()
-            cursor.execute(f"select `creation_date` from `media_storage_state` where `data_source_type` = ? and `data_source_id` = ?",
-                           (self.data_source_type, self.data_source_id))
-            record = cursor.fetchone()
-            if record:
-                return record[0]
+        records = self.store.fetch(
+            "select `creation_date` from `media_storage_state` where `data_source_type` = ? and `data_source_id` = ?",
+            (self.data_source_type, self.data_source_id)
+        )
+        if records:
+            return records[0][0]
 
-            return 0
+        return 0
 
 
 class Connector(ManagedConnector):
@@ -78,8 +72,17 @@ class Connector(ManagedConnector):
 
         self.overwrite_reports = settings.pop('overwrite_reports', False) in TRUE_VALUES
         self.data_sources = settings.pop('data_sources', [])
+        self.download_concurrency = int(settings.pop('download_concurrency', 0) or 0)
+        self.deduplicate_reports = settings.pop('deduplicate_reports', False) in TRUE_VALUES
+        self.compress_reports = settings.pop('compress_reports', False) in TRUE_VALUES
+        self.objects_path = os.path.join(self.folder_path, REPORT_OBJECTS_FOLDER)
+        if self.deduplicate_reports:
+            os.makedirs(self.objects_path, exist_ok=True)
         super().__init__(section, settings)
 
+        if self.download_concurrency < 1:
+            self.download_concurrency = self.settings.get('__workers__', 2)
+
         # force the save_data to be false just because of the nature of the connector - it cannot dumps the content of the file to the JSON
         self.settings["__save_data__"] = False
 
@@ -108,12 +111,139 @@ class Connector(ManagedConnector):
         """
         return {}
 
-    def writer(self, file_name, content):
-        with open(os.path.join(self.folder_path, file_name), 'wb') as report:
-            report.write(content)
+    @staticmethod
+    def compress(source_path) -> str:
+        compressed_path = f'{source_path}.gz'
+        with open(source_path, 'rb') as source, gzip.open(compressed_path, 'wb') as compressed:
+            shutil.copyfileobj(source, compressed, DOWNLOAD_CHUNK_SIZE)
+        os.remove(source_path)
+        return compressed_path
+
+    def store_object(self, downloaded_path, checksum) -> str:
+        """
+        Keep the single copy of the content in the content-addressed store, return the path of the stored copy
+        """
+        object_path = os.path.join(self.objects_path, checksum + ('.gz' if self.compress_reports else ''))
+        if os.path.exists(object_path):
+            os.remove(downloaded_path)
+        else:
+            os.replace(downloaded_path, object_path)
+        return object_path
+
+    def link_object(self, object_path, target_path, checksum):
+        """
+        Expose the stored content under the report name as the hardlink. If the file system does not support hardlinks
+        the report is only recorded in the manifest pointing to the stored copy
+        """
+        temporary_link = f'{target_path}.link'
+        try:
+            if os.path.exists(temporary_link):
+                os.remove(temporary_link)
+            os.link(object_path, temporary_link)
+            os.replace(temporary_link, target_path)
+            status = 'linked'
+        except OSError:
+            self.logger.warning("Cannot create the hardlink for %s, the report is available as %s", target_path, object_path)
+            status = 'stored'
+
+        get_state_store().set(REPORT_MANIFEST_NAMESPACE, target_path, {'object': object_path}, status=status, checksum=checksum)
+
+    def writer(self, file_name, downloaded_path, checksum=None):
+        """
+        Atomically move the completely downloaded file to its final place, so the half-written reports are never visible.
+        Optionally compress the report and store the identical reports only once
+        """
+        if self.compress_reports:
+            file_name = f'{file_name}.gz'
+            downloaded_path = self.compress(downloaded_path)
+
+        target_path = os.path.join(self.folder_path, file_name)
+        if self.deduplicate_reports and checksum:
+            self.link_object(self.store_object(downloaded_path, checksum), target_path, checksum)
+        else:
+            os.replace(downloaded_path, target_path)
+
+    def get_partial_path(self, uid):
+        return os.path.join(self.folder_path, f'.{uid}.part')
 
-    def file_fetcher(self, url):
-        return self.get(url).content
+    def _stream_to_file(self, url, destination, expected_checksum=None) -> str:
+        checksum = hashlib.sha256()
+        offset = 0
+        if os.path.exists(destination):
+            # continue the interrupted download, take into account what is already on disk
+            with open(destination, 'rb') as partial:
+                for chunk in iter(lambda: partial.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    checksum.update(chunk)
+                    offset += len(chunk)
+
+        headers = dict(self.get_headers())
+        # the size and the range are counted in the bytes written to disk, so the content must not be compressed in transit
+        headers['Accept-Encoding'] = 'identity'
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+
+        response = self._get_session().get(url, headers=headers, stream=True, verify=self.get_verification())
+        if offset and response.status_code == 416:
+            # the partial file is not valid anymore, start from scratch
+            response.close()
+            os.remove(destination)
+            return self._stream_to_file(url, destination, expected_checksum)
+        response.raise_for_status()
+
+        if offset and response.status_code != 206:
+            # the server ignored the range, the full content is coming
+            self.logger.info("Server does not support resuming of %s, downloading from the beginning", url)
+            checksum = hashlib.sha256()
+            offset = 0
+
+        expected_size = None
+        if response.headers.get('Content-Encoding', 'identity') != 'identity':
+            # the server compressed the content anyway, its length says nothing about the decoded bytes on disk
+            self.logger.info("Server compressed %s despite the identity encoding requested, the size is not verified", url)
+        elif response.headers.get('Content-Length'):
+            expected_size = offset + int(response.headers['Content-Length'])
+
+        with open(destination, 'ab' if offset else 'wb') as report:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                report.write(chunk)
+                checksum.update(chunk)
+
+        if expected_size is not None and os.path.getsize(destination) != expected_size:
+            # keep the partial file, the next attempt continues from here
+            raise RequestException(f'Download of {url} was interrupted at {os.path.getsize(destination)} of {expected_size} bytes')
+
+        if expected_checksum and checksum.hexdigest() != expected_checksum.lower():
+            os.remove(destination)
+            raise DownloadIntegrityError(f'Checksum of the file downloaded from {url} does not match the expected one')
+
+        return checksum.hexdigest()
+
+    def file_fetcher(self, url, destination, expected_checksum=None) -> str:
+        """
+        Stream the file to the given path in fixed-size chunks instead of keeping the whole content in memory.
+        The interrupted download is resumed with the HTTP Range request, the result is verified against the expected SHA-256 checksum if it is given
+
+        :return: SHA-256 checksum of the downloaded file
+        """
+        for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+            try:
+                return self._stream_to_file(url, destination, expected_checksum)
+            except (RequestException, DownloadIntegrityError) as exc:
+                if attempt == DOWNLOAD_ATTEMPTS:
+                    raise
+                self.logger.warning("Download of %s failed (attempt %s of %s): %s", url, attempt, DOWNLOAD_ATTEMPTS, exc)
+
+    def download(self, media_file):
+        """
+        Fetch the file in advance, the failure is kept within the record and reported when the record is processed
+        """
+        partial_path = self.get_partial_path(media_file['uid'])
+        try:
+            media_file['downloaded_sha256'] = self.file_fetcher(media_file['url'], partial_path, media_file.get('sha256'))
+            media_file['downloaded_path'] = partial_path
+        except Exception as exc:
+            media_file['download_error'] = exc
+        return media_file
 
     def mark_the_file_as_downloaded(self, uid, success=True, error_message=None):
         if success:
@@ -131,10 +261,20 @@ class Connector(ManagedConnector):
             else:
                 filename = f"{arrow.get(data['creation_date']).format('YYYYMMDDHHmmss')}_{data['filename']}"
 
-            binary_content = self.file_fetcher(data['url'])
+            if data.get('download_error'):
+                raise data['download_error']
+
+            if not data.get('downloaded_path'):
+                self.download(data)
+                if data.get('download_error'):
+                    raise data['download_error']
 
-            self.writer(filename, binary_content)
+            self.writer(filename, data['downloaded_path'], data.get('downloaded_sha256'))
         except Exception as exc:
+            # the file is marked as processed anyway, so there is nothing to resume later
+            for leftover in (self.get_partial_path(data['uid']), f"{self.get_partial_path(data['uid'])}.gz"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
             self.mark_the_file_as_downloaded(data['uid'], success=False, error_message=str(exc))
             raise
         else:
@@ -142,32 +282,51 @@ class Connector(ManagedConnector):
         finally:
             self.current_state_keeper.mark_as_processed(data['creation_date'])
 
-    def _load_records(self, options):
+    def get_data_sources(self) -> list:
+        if self.data_sources:
+            return self.data_sources
+
+        # fallback compatibility with the media storage concept to the default sources
+        return [
+            {'type': 'reports_connectors', 'id': self.ConnectorID}
+        ]
+
+    def get_oomnitza_bootstrap_requirements(self):
         """
-        Download the reports one by one from the cloud
+        The lists of the media files for all the data sources do not depend on each other, so fetch them at once
         """
-        oomnitza_access_token = self.get_oomnitza_auth_for_sync()
-        self.OomnitzaConnector.settings['api_token'] = oomnitza_access_token
-        self.OomnitzaConnector.authenticate()
+        requirements = {}
+        for data_source in self.get_data_sources():
+            last_processed = PersistentStateKeeper(data_source['type'], data_source['id']).get_last_processed()
+            requirements[(data_source['type'], data_source['id'])] = (
+                'get_media_storage_files',
+                last_processed,
+                data_source['type'],
+                data_source['id']
+            )
+        return requirements
 
-        data_sources = self.data_sources
-        if not data_sources:
-            # fallback compatibility with the media storage concept to the default sources
-            data_sources = [
-                {'type': 'reports_connectors', 'id': self.ConnectorID}
-            ]
+    def _load_records(self, options):
+        """
+        Walk all the pages of the reports in the cloud and download them concurrently.
+        The downloaded files are yielded in the order of their creation date, so the progress is recorded in the same order
+        """
+        first_pages = self.prepare_oomnitza_for_sync()
+        connection_pool = Pool(size=self.download_concurrency)
 
-        for data_source in data_sources:
+        for data_source in self.get_data_sources():
             data_source_type = data_source['type']
             data_source_id = data_source['id']
             self.current_state_keeper = PersistentStateKeeper(data_source_type, data_source_id)
-            last_processed = self.current_state_keeper.get_last_processed()
 
-            media_files = self.OomnitzaConnector.get_media_storage_files(
-                last_processed,
+            media_files = self.OomnitzaConnector.iterate_media_storage_files(
+                self.current_state_keeper.get_last_processed(),
                 data_source_type,
-                data_source_id
+                data_source_id,
+                first_page=first_pages[(data_source_type, data_source_id)]
             )
 
-            for media_file in media_files:
+            for media_file in connection_pool.imap(self.download, media_files, maxsize=self.download_concurrency):
                 yield media_file
+
+        get_state_store().flush()
@@ -9,12 +9,13 @@ from requests.auth import _basic_auth_str
 from requests.exceptions import RetryError
 
 from lib.connector import AssetsConnector
+from utils.concurrency import AdaptiveConcurrencyMixin
 from utils.distutils import strtobool
 
 Version = Enum('Version', ['v1', 'v2'])  # TODO: set proper cases
 
 
-class Connector(AssetsConnector):
+class Connector(AdaptiveConcurrencyMixin, AssetsConnector):
     MappingName = 'MobileIron'
     RetryCount = 10
 
@@ -27,6 +28,9 @@ class Connector(AssetsConnector):
         'include_checkin_devices_only': {'order': 6, 'example': 'True', 'default': 'True'},
         'last_checkin_date_threshold': {'order': 7, 'example': '129600', 'default': '129600'},
         'authorization_settings': {'order': 9, 'default': {}},
+        'adaptive_concurrency': {'order': 10, 'default': "False"},
+        'min_concurrency': {'order': 11, 'default': "1"},
+        'max_concurrency': {'order': 12, 'default': "8"},
     }
 
     api_version = None
@@ -39,6 +43,7 @@ class Connector(AssetsConnector):
             self.api_version = Version.v1
         self._retry_counter = 0
         self.authorization_settings = self.settings.get('authorization_settings', {})
+        self.init_concurrency('MobileIron')
 
     def get_headers(self):
         if self.settings.get('authorization_settings'):
@@ -147,14 +152,14 @@ class Connector(AssetsConnector):
         if not isinstance(devices, list):
             raise AssertionError(f'The devices must be in a form of list')
 
-        pool_size = self.settings.get('__workers__', 2)
+        pool_size = self.get_pool_size()
         connection_pool = Pool(size=pool_size)
         return connection_pool.map(self.load_primary_cpu_hdd_ram_and_serial_for_windows_device, devices)
 
     def load_devices_api_v1(self, *a, **kw):
         for partition in self.fetch_all_partitions():
             if self.settings['partitions'] == "All" or partition['name'] in self.settings['partitions']:
-                pool_size = self.settings.get('__workers__', 2)
+                pool_size = self.get_pool_size()
                 connection_pool = Pool(size=pool_size)
                 for device in connection_pool.imap(self.load_hardware_and_serial_for_windows_devices,
                                                    self.fetch_all_devices_for_partition(partition['id']),
@@ -244,6 +249,8 @@ class Connector(AssetsConnector):
         for device in generator:
             yield device
 
+        self.log_concurrency_stats()
+
     def load_cloud_records(self, credential_details=None):
         yield from self._load_records(credential_details)
 
@@ -1,11 +1,23 @@
 import pprint
 import os
+from typing import Dict
 
+import gevent
 from constants import FATAL_ERROR_FLAG
 from lib.connector import AuthenticationError, BaseConnector
 from lib.error import ConfigError
 from lib.version import VERSION
 from requests import RequestException
+from requests.exceptions import RetryError
+from utils.rate_limiter import PRIORITY_CONTROL, PRIORITY_DATA, get_bucket, parse_retry_after
+
+AUTH_FAILURE_STATUSES = (401, 403)
+THROTTLING_STATUSES = (429, 503)
+# the pause of all the calls when the throttling response came without `Retry-After` or the transport has already
+# exhausted its own retries of it
+DEFAULT_THROTTLING_BACKOFF = 30
+
+MEDIA_STORAGE_PAGE_SIZE = 100
 
 CSRF_HEADER = "X-CSRF-Token"
 CONNECTOR_SOURCE = "X-Connector-Source"
@@ -17,7 +29,13 @@ class Connector(BaseConnector):
         'api_token': {'order': 2, 'example': "", 'default': ""},
         'username':  {'order': 3, 'example': "oomnitza-sa", 'default': ""},
         'password':  {'order': 4, 'example': "ThePassword", 'default': ""},
-
+        # requests per second shared by all the syncs of the process, empty value disables the limiting
+        'rate_limit':           {'order': 5, 'example': "10", 'default': ""},
+        'rate_limit_burst':     {'order': 6, 'example': "20", 'default': ""},
+        # the tokens kept for the control calls (portion finalization, checking of the managed configs, etc)
+        'rate_limit_reserve':   {'order': 7, 'example': "2", 'default': "2"},
+        # share the limit with the other connector processes on the same host
+        'rate_limit_lock_file': {'order': 8, 'example': "/tmp/oomnitza_rate_limit.json", 'default': ""},
     }
     # no FieldMappings for oomnitza connector
     FieldMappings = {}
@@ -25,13 +43,77 @@ class Connector(BaseConnector):
     def __init__(self, section, settings):
         """Initialize the connector."""
         self._csrf_token = None
+        self._auth_check_pending = False
         super(Connector, self).__init__(section, settings)
-        self.authenticate()
+        self.rate_limiter = self.init_rate_limiter()
+        self.authenticate(deferred=True)
+
+    def init_rate_limiter(self):
+        if not self.settings.get('rate_limit'):
+            return None
+
+        try:
+            rate = float(self.settings['rate_limit'])
+            burst = float(self.settings.get('rate_limit_burst') or 0)
+            reserve = float(self.settings.get('rate_limit_reserve') or 0)
+        except ValueError:
+            raise ConfigError("Oomnitza section: rate_limit, rate_limit_burst and rate_limit_reserve must be numbers")
+
+        if rate <= 0:
+            raise ConfigError("Oomnitza section: rate_limit must be greater than 0, leave it empty to disable the limiting")
+
+        return get_bucket(
+            self.settings['url'],
+            rate=rate,
+            burst=burst,
+            reserve=reserve,
+            lock_file=self.settings.get('rate_limit_lock_file') or None
+        )
 
     def _extract_csrf_token(self, response):
         if CSRF_HEADER in response.headers:
             self._csrf_token = response.headers[CSRF_HEADER]
 
+    def _honor_retry_after(self, response, exc=None):
+        if not self.rate_limiter:
+            return
+
+        if isinstance(exc, RetryError):
+            # the transport has retried the throttled call on its own and gave up, the response is not available anymore
+            self.rate_limiter.block_for(DEFAULT_THROTTLING_BACKOFF)
+        elif response is not None and response.status_code in THROTTLING_STATUSES:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self.rate_limiter.block_for(retry_after or DEFAULT_THROTTLING_BACKOFF)
+
+    def _call(self, method, *args, priority=PRIORITY_DATA, **kwargs):
+        """
+        Perform the request within the shared rate limit and, if the token was not verified yet, treat this request
+        as the authentication check: the auth failure is reported as AuthenticationError exactly like the dedicated AuthTest call did
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire(priority)
+
+        pending = self._auth_check_pending
+        try:
+            response = method(*args, **kwargs)
+        except RequestException as exp:
+            response = getattr(exp, 'response', None)
+            self._honor_retry_after(response, exp)
+            if pending and (response is None or response.status_code in AUTH_FAILURE_STATUSES):
+                raise AuthenticationError(str(exp))
+            raise
+
+        self._honor_retry_after(response)
+        self._auth_check_pending = False
+        self._extract_csrf_token(response)
+        return response
+
+    def get(self, url, *args, priority=PRIORITY_DATA, **kwargs):
+        return self._call(super(Connector, self).get, url, *args, priority=priority, **kwargs)
+
+    def post(self, url, *args, priority=PRIORITY_DATA, **kwargs):
+        return self._call(super(Connector, self).post, url, *args, priority=priority, **kwargs)
+
     def get_connector_name(self):
         """ Return connector name to be used for logging. """
         return "connectors/oomnitza"
@@ -61,7 +143,13 @@ class Connector(BaseConnector):
             headers.update({CONNECTOR_SOURCE: source})
         return headers
 
-    def authenticate(self):
+    def authenticate(self, deferred=False):
+        """
+        Validate the Oomnitza credentials.
+
+        :param deferred: if the API token is already known, do not spend the extra AuthTest round trip now,
+            the first real request to Oomnitza will act as the authentication check
+        """
         if not any((
             self.settings['api_token'],
             self.settings.get('user_pem_file'),
@@ -74,10 +162,11 @@ class Connector(BaseConnector):
 
         try:
             if self.settings['api_token']:
-                response = self.get(
-                    "{url}/api/v2/mappings?name=AuthTest".format(**self.settings)
-                )
-                self._extract_csrf_token(response)
+                self._auth_check_pending = True
+                if deferred:
+                    return
+
+                self.get("{url}/api/v2/mappings?name=AuthTest".format(**self.settings), priority=PRIORITY_CONTROL)
                 return
 
             auth_url = "{url}/api/request_token".format(**self.settings)
@@ -86,12 +175,35 @@ class Connector(BaseConnector):
                 {'login': self.settings['username'],
                  'password': self.settings['password']},
                 post_as_json=False,
+                priority=PRIORITY_CONTROL,
             )
             self.settings['api_token'] = response.json()["token"]
-            self._extract_csrf_token(response)
         except RequestException as exp:
             raise AuthenticationError(str(exp))
 
+    def bootstrap(self, requirements: Dict[str, tuple]) -> dict:
+        """
+        Issue the independent start-up calls to Oomnitza concurrently instead of one after another.
+
+        :param requirements: the mapping of the result key to the tuple of the connector method name and its arguments,
+            for example {'mappings': ('get_mappings', 'Casper'), 'locations': ('get_location_mappings', 'location_id', 'name')}
+        :return: the mapping of the same keys to the results of the calls
+        """
+        if not requirements:
+            return {}
+
+        jobs = {
+            key: gevent.spawn(getattr(self, method_name), *args)
+            for key, (method_name, *args) in requirements.items()
+        }
+        try:
+            gevent.joinall(list(jobs.values()), raise_error=True)
+        finally:
+            # the first failure stops the bootstrap, the other calls are of no use anymore
+            gevent.killall([job for job in jobs.values() if not job.ready()])
+
+        return {key: job.value for key, job in jobs.items()}
+
     def upload(self, payload):
         url = f"{self.settings['url']}/api/v3/bulk"
         response = self.post(url, payload)
@@ -99,12 +211,12 @@ class Connector(BaseConnector):
 
     def finalize_portion(self, portion_id):
         url = f"{self.settings['url']}/api/v3/bulk/{portion_id}/finalize"
-        response = self.post(url, {})
+        response = self.post(url, {}, priority=PRIORITY_CONTROL)
         return response
 
     def create_synthetic_finalized_successful_portion(self, service_id, correlation_id):
         url = f"{self.settings['url']}/api/v3/bulk/{service_id}/add_ready_portion"
-        self.post(url, {'correlation_id': str(correlation_id), 'added': 1})
+        self.post(url, {'correlation_id': str(correlation_id), 'added': 1}, priority=PRIORITY_CONTROL)
 
     def create_synthetic_finalized_failed_portion(
         self,
@@ -128,7 +240,7 @@ class Connector(BaseConnector):
         if is_fatal:
             payload['error_type'] = FATAL_ERROR_FLAG
 
-        self.post(url, payload)
+        self.post(url, payload, priority=PRIORITY_CONTROL)
 
     def create_synthetic_finalized_empty_portion(self, service_id, correlation_id, multi_str_input_value=None):
         url = f"{self.settings['url']}/api/v3/bulk/{service_id}/add_ready_portion"
@@ -139,7 +251,7 @@ class Connector(BaseConnector):
             "multi_str_input_value": multi_str_input_value
         }
 
-        self.post(url, payload)
+        self.post(url, payload, priority=PRIORITY_CONTROL)
 
     @staticmethod
     def test_upload(users):
@@ -168,19 +280,37 @@ class Connector(BaseConnector):
         response = self.get(url)
         return response.json()
 
-    def get_media_storage_files(self, creation_date, source_type, source_id):
+    def get_media_storage_files(self, creation_date, source_type, source_id, skip=0, limit=MEDIA_STORAGE_PAGE_SIZE):
         """
-        The API endpoint that returns the list of report files is de-facto paginated but because the connector is running every twenty seconds it is OK
-        to just fetch the current page and process only it, so the next connector run will process the next page and so on
+        Return the single page of the report files created after the given date, the oldest files first
         """
         url = f"{self.settings['url']}/api/v3/media_storage?filter=" \
               f"(creation_date gt {creation_date}) and " \
               f"(created_by_type eq '{source_type}')" \
               f"&created_by_id={source_id}" \
-              f"&sortby=creation_date asc"
+              f"&sortby=creation_date asc" \
+              f"&skip={skip}&limit={limit}"
         response = self.get(url)
         return response.json()
 
+    def iterate_media_storage_files(self, creation_date, source_type, source_id, first_page=None, limit=MEDIA_STORAGE_PAGE_SIZE):
+        """
+        Walk all the pages of the report files created after the given date, so the backlog is drained within the single run.
+        The new files are always appended to the end of the list sorted by the creation date, so the offset-based pagination is stable here
+
+        :param first_page: the already fetched first page, if any
+        """
+        skip = 0
+        page = first_page if first_page is not None else self.get_media_storage_files(creation_date, source_type, source_id, skip, limit)
+        while page:
+            yield from page
+
+            if len(page) < limit:
+                break
+
+            skip += limit
+            page = self.get_media_storage_files(creation_date, source_type, source_id, skip, limit)
+
     def get_location_mappings(self, id_field, label_field):
         try:
             url = "{0}/api/v3/locations".format(self.settings['url'])
@@ -228,7 +358,8 @@ class Connector(BaseConnector):
         """
         return self.post(
             f'{self.settings["url"]}/api/v3/bulk/check_managed',
-            data={'version': VERSION}
+            data={'version': VERSION},
+            priority=PRIORITY_CONTROL
         ).json()
 
     def get_secret_by_credential_id(
@@ -313,5 +444,6 @@ class Connector(BaseConnector):
 
     def get_portion_info(self, correlation_id: str) -> dict:
         return self.get(
-            f'{self.settings["url"]}/api/v3/bulk/{correlation_id}'
+            f'{self.settings["url"]}/api/v3/bulk/{correlation_id}',
+            priority=PRIORITY_CONTROL
         ).json()
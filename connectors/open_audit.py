@@ -1,7 +1,7 @@
 import logging
 
-import requests
 from lib.connector import AssetsConnector
+from utils.http_transport import get_session
 
 
 class Connector(AssetsConnector):
@@ -30,7 +30,8 @@ class Connector(AssetsConnector):
             url=self.settings['url'],
             username=self.settings['username'],
             password=self.settings['password'], 
-            logger=self.logger
+            logger=self.logger,
+            pool_size=self.settings.get('__workers__', 2)
         )
 
     def authenticate(self):
@@ -57,12 +58,14 @@ class Connector(AssetsConnector):
 
 class OpenAuditCommunityAPI(object):
     """https://community.opmantek.com/display/OA/The+Open-AudIT+API"""
-    def __init__(self, url, username, password, logger):
+    def __init__(self, url, username, password, logger, pool_size=None):
         self.url = url
         self.username = username
         self.password = password
         self.session_id = None
         self.logger = logger
+        # keep-alive connections shared with the other users of the same host
+        self.http = get_session(url, pool_size=pool_size)
 
     def get_url(self, parts):
         """Returns a complete URL, combining the base url and provided parts."""
@@ -83,7 +86,7 @@ class OpenAuditCommunityAPI(object):
         
         self.logger.info("Issuing POST %s", url)
         
-        response = requests.post(url=url, data=data, headers=headers)
+        response = self.http.post(url=url, data=data, headers=headers)
         
         try:
             response.raise_for_status()
@@ -105,7 +108,7 @@ class OpenAuditCommunityAPI(object):
 
         self.logger.info("Issuing GET %s", url)
             
-        response = requests.get(
+        response = self.http.get(
             url=url,
             headers=headers
         )
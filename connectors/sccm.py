@@ -1,8 +1,12 @@
+import json
 import re
+from datetime import datetime, timedelta
 
 import pyodbc
+from constants import TRUE_VALUES
 from lib.connector import AssetsConnector
 from lib.error import ConfigError
+from utils.state_store import get_state_store
 
 #  http://www.mssccm.com/category/sccm-reports-sccm-sql-queries/
 #
@@ -15,7 +19,9 @@ SELECT cs.ResourceID AS resource_id,
        cs.SystemType0 AS platform,
        cs.UserName0 AS user_name,
        processor.Name0 AS cpu,
+       disc.DeviceID0 AS disk_id,
        disc.Size0 AS hdd_total_mb,
+       net.Index0 AS network_adapter_id,
        net.IPAddress0 AS ipv4_address,
        net.MACAddress0 AS mac_address,
        mem.TotalPhysicalMemory0 AS memory_total_kb,
@@ -39,7 +45,8 @@ SELECT cs.ResourceID AS resource_id,
     LEFT OUTER JOIN dbo.v_GS_PC_BIOS AS bios ON cs.ResourceID = bios.ResourceID
     LEFT OUTER JOIN dbo.v_R_System AS rsys ON cs.ResourceID = rsys.ResourceID
     LEFT OUTER JOIN dbo.v_UserMachineRelationship AS umr ON cs.ResourceID = umr.MachineResourceID
-    LEFT OUTER JOIN dbo.v_GS_OPERATING_SYSTEM AS os ON cs.ResourceID = os.ResourceID;"""
+    LEFT OUTER JOIN dbo.v_GS_OPERATING_SYSTEM AS os ON cs.ResourceID = os.ResourceID{filter}
+ ORDER BY cs.ResourceID;"""
 
 SoftwareSQL = """
 SELECT DisplayName0 AS 'name',
@@ -55,6 +62,57 @@ SELECT DisplayName0 AS 'name',
  WHERE ResourceID = ?
 """
 
+# The software of all the resources at once, ordered the same way as the MainSQL, so both can be merged as they stream
+BulkSoftwareSQL = """
+SELECT ResourceID AS resource_id,
+       DisplayName0 AS 'name',
+       Version0 AS 'version',
+       Publisher0 AS 'publisher'
+  FROM dbo.v_GS_ADD_REMOVE_PROGRAMS{filter}
+UNION
+SELECT ResourceID AS resource_id,
+       DisplayName0 AS 'name',
+       Version0 AS 'version',
+       Publisher0 AS 'publisher'
+  FROM dbo.v_GS_ADD_REMOVE_PROGRAMS_64{filter}
+ ORDER BY resource_id;"""
+
+# The incremental sync selects only the resources with the hardware or software inventory reported
+# after the latest scans seen by the previous sync
+ChangedResourcesFilter = """
+ WHERE {column} IN (SELECT ResourceID FROM dbo.v_GS_WORKSTATION_STATUS WHERE LastHWScan > ?
+                    UNION
+                    SELECT ResourceID FROM dbo.v_GS_LastSoftwareScan WHERE LastScanDate > ?)"""
+
+InventoryWatermarkSQL = """
+SELECT (SELECT MAX(LastHWScan) FROM dbo.v_GS_WORKSTATION_STATUS) AS last_hardware_scan,
+       (SELECT MAX(LastScanDate) FROM dbo.v_GS_LastSoftwareScan) AS last_software_scan;"""
+
+INVENTORY_WATERMARK_NAMESPACE = 'sccm.inventory_watermark'
+DEFAULT_FULL_SYNC_INTERVAL_DAYS = 7
+
+# the number of the rows fetched from the server at once
+DEFAULT_FETCH_SIZE = 1000
+
+# The joins returning several rows per resource (disks, network adapters, user relationships): the column identifying
+# the joined row and the columns taken from it. The rows of the resource are the product of these joins, so the joined
+# rows are told apart by their keys. The values of every joined row are kept in the `<column>_list` field,
+# the column itself keeps the primary value
+MULTI_VALUED_JOINS = (
+    ('disk_id', ('hdd_total_mb',)),
+    ('network_adapter_id', ('ipv4_address', 'mac_address')),
+    ('primary_user', ('primary_user',)),
+)
+MULTI_VALUED_COLUMNS = tuple(column for _, columns in MULTI_VALUED_JOINS for column in columns)
+# the keys of the joined rows are not part of the resource
+JOIN_KEY_COLUMNS = tuple(key for key, columns in MULTI_VALUED_JOINS if key not in columns)
+# the primary value is either picked from one of the joined rows or, for the sizes, is the total of all of them
+PRIMARY_SELECTORS = ('first', 'min', 'max', 'sum')
+SUMMABLE_COLUMNS = ('hdd_total_mb',)
+
+SOFTWARE_LOADING_BULK = 'bulk'
+SOFTWARE_LOADING_PER_RESOURCE = 'per_resource'
+
 
 class Connector(AssetsConnector):
     MappingName = 'SCCM'
@@ -65,6 +123,11 @@ class Connector(AssetsConnector):
         'password':          {'order': 4, 'example': 'change-me'},
         'authentication':    {'order': 5, 'default': "SQL Server", 'choices': ("SQL Server", "Windows")},
         'driver':            {'order': 7, 'default': ''},
+        'software_loading':  {'order': 8, 'default': SOFTWARE_LOADING_BULK, 'choices': (SOFTWARE_LOADING_BULK, SOFTWARE_LOADING_PER_RESOURCE)},
+        'fetch_size':        {'order': 9, 'default': str(DEFAULT_FETCH_SIZE)},
+        'primary_selection': {'order': 10, 'example': '{"hdd_total_mb": "sum"}', 'is_json': True, 'default': '{}'},
+        'incremental_sync':  {'order': 11, 'default': "False"},
+        'full_sync_interval_days': {'order': 12, 'default': str(DEFAULT_FULL_SYNC_INTERVAL_DAYS)},
     }
 
     DefaultConverters = {
@@ -78,6 +141,33 @@ class Connector(AssetsConnector):
     def __init__(self, section, settings):
         super(Connector, self).__init__(section, settings)
         self.db = None
+        self.software_loading = self.settings.get('software_loading') or SOFTWARE_LOADING_BULK
+        self.fetch_size = max(int(self.settings.get('fetch_size') or DEFAULT_FETCH_SIZE), 1)
+
+        primary_selection = self.settings.get('primary_selection') or {}
+        if not isinstance(primary_selection, dict):
+            primary_selection = json.loads(primary_selection)
+        for column, selector in primary_selection.items():
+            if column not in MULTI_VALUED_COLUMNS or selector not in PRIMARY_SELECTORS:
+                raise ConfigError('Invalid primary selection %r for %r. The columns are: %s, the selections are: %s' % (
+                    selector, column, ', '.join(MULTI_VALUED_COLUMNS), ', '.join(PRIMARY_SELECTORS)))
+            if selector == 'sum' and column not in SUMMABLE_COLUMNS:
+                raise ConfigError('Invalid primary selection %r for %r. Only %s can be summed up' % (
+                    selector, column, ', '.join(SUMMABLE_COLUMNS)))
+        for _, columns in MULTI_VALUED_JOINS:
+            # the columns of the same joined row are picked together, so they cannot be selected differently
+            if len({primary_selection[column] for column in columns if column in primary_selection}) > 1:
+                raise ConfigError('Primary selection of %s must be the same, they are taken from the same row' % (
+                    ', '.join(columns)))
+        self.primary_selection = primary_selection
+
+        # The incremental sync loads only the resources inventoried since the previous sync,
+        # all the resources are loaded once in `full_sync_interval_days`
+        self.incremental_sync = self.settings.get('incremental_sync', 'False') in TRUE_VALUES
+        self.full_sync_interval_days = int(self.settings.get('full_sync_interval_days') or DEFAULT_FULL_SYNC_INTERVAL_DAYS)
+        self.state_key = f"{self.settings['server']}/{self.settings['database']}"
+        # the number of the failed queries, the incremental sync does not move its watermark past the failed one
+        self.query_errors = 0
 
     @staticmethod
     def pick_odbc_driver(driver_candidate):
@@ -112,14 +202,11 @@ class Connector(AssetsConnector):
                               'https://docs.microsoft.com/en-us/sql/connect/odbc/download-odbc-driver-for-sql-server')
         return driver_candidate
 
-    def authenticate(self):
+    def connect(self):
         """
-        Connect to the database using Windows or SQL Server authentication
+        Open the new connection to the database using Windows or SQL Server authentication
         :return: Connection object
         """
-        if self.db:
-            return
-
         connect_args = {
             "driver": "{%s}" % self.pick_odbc_driver(self.settings['driver']),
             # NOTE: driver string has to be enclosed with curvy brackets like "{SQL Server}" or "{ODBC Driver 17 for SQL Server}",
@@ -132,7 +219,52 @@ class Connector(AssetsConnector):
             connect_args["user"] = self.settings['username']
             connect_args["password"] = self.settings['password']
 
-        self.db = pyodbc.connect(**connect_args)
+        return pyodbc.connect(**connect_args)
+
+    def authenticate(self):
+        """
+        Connect to the database using Windows or SQL Server authentication
+        """
+        if self.db:
+            return
+
+        self.db = self.connect()
+
+    def stream_query(self, sql, *args, db=None, raise_errors=False):
+        """
+        Performs a database query and streams the rows as they come from the server, `fetch_size` rows at a time.
+        :param db: the connection to use instead of the main one, to stream several queries at the same time
+        :param raise_errors: raise the errors of the query and of the fetching instead of ending the stream early
+        :return: the map of the column name to its position in the row and the iterator of the rows
+        """
+        try:
+            cursor = (db or self.db).cursor()
+            cursor.arraysize = self.fetch_size
+            cursor.execute(sql, args)
+        except Exception as exception:
+            self.logger.error("Unable to perform query: %s" % (exception))
+            self.query_errors += 1
+            if raise_errors:
+                raise
+            return {}, iter(())
+
+        column_index = {column[0]: position for position, column in enumerate(cursor.description)}
+        return column_index, self.fetch_rows(cursor, raise_errors)
+
+    def fetch_rows(self, cursor, raise_errors=False):
+        try:
+            while True:
+                rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        except Exception as exception:
+            self.logger.error("Unable to fetch the query results: %s" % (exception))
+            self.query_errors += 1
+            if raise_errors:
+                raise
+        finally:
+            cursor.close()
 
     def query(self, sql, *args):
         """
@@ -140,32 +272,238 @@ class Connector(AssetsConnector):
         :param sql: SQL query
         :return: Array of dictionaries
         """
+        column_index, rows = self.stream_query(sql, *args)
+        columns = list(column_index)
+        return [dict(zip(columns, row)) for row in rows]
+
+    @staticmethod
+    def collect_joined_rows(rows, positions, key_column, columns):
+        """
+        Return the values of the given columns of every distinct joined row, the rows are told apart by the key column
+        :return: Array of tuples
+        """
+        joined_rows = {}
+        for row in rows:
+            key = row[positions[key_column]]
+            if key is not None and key not in joined_rows:
+                joined_rows[key] = tuple(row[positions[column]] for column in columns)
+        return list(joined_rows.values())
+
+    def select_primary(self, columns, joined_rows):
+        """
+        Pick the primary values of the columns of the joined rows, all of them are taken from the same joined row
+        :return: Array of the primary values of the columns
+        """
+        selector = next((self.primary_selection[column] for column in columns if column in self.primary_selection), 'first')
+        selected_column = next((column for column in columns if column in self.primary_selection), columns[0])
+        position = columns.index(selected_column)
+        candidates = [joined_row for joined_row in joined_rows if joined_row[position] is not None]
+        if not candidates:
+            return [None] * len(columns)
+
         try:
-            cursor = self.db.cursor()
-            results = cursor.execute(sql, args)
-            columns = [column[0] for column in cursor.description]
-            return [dict(list(zip(columns, row))) for row in results.fetchall()]
-        except Exception as exception:
-            self.logger.error("Unable to perform query: %s" % (exception))
-            return []
+            if selector == 'sum':
+                return [sum(joined_row[position] for joined_row in candidates)]
+            if selector in ('min', 'max'):
+                return list((min if selector == 'min' else max)(candidates, key=lambda joined_row: joined_row[position]))
+        except TypeError:
+            # the values cannot be compared or summed up
+            pass
+        return list(candidates[0])
+
+    def aggregate_resource(self, rows, columns):
+        """
+        Combine the rows of the same resource produced by the joins into the single resource dict
+        """
+        resource = {}
+        for position, column in enumerate(columns):
+            if column not in MULTI_VALUED_COLUMNS and column not in JOIN_KEY_COLUMNS:
+                resource[column] = next((row[position] for row in rows if row[position] is not None), None)
+
+        positions = {column: position for position, column in enumerate(columns)}
+        for key_column, joined_columns in MULTI_VALUED_JOINS:
+            joined_rows = self.collect_joined_rows(rows, positions, key_column, joined_columns)
+            primary_values = self.select_primary(joined_columns, joined_rows)
+            for index, column in enumerate(joined_columns):
+                resource[column] = primary_values[index]
+                resource[f'{column}_list'] = [joined_row[index] for joined_row in joined_rows if joined_row[index] is not None]
+        return resource
+
+    def iterate_resources(self, sql, *args, raise_errors=False):
+        """
+        Stream the resources, the consecutive rows of the same resource are combined, so every resource is yielded once
+        :return: Iterator of dictionaries
+        """
+        column_index, rows = self.stream_query(sql, *args, raise_errors=raise_errors)
+        columns = list(column_index)
+        resource_id_position = column_index.get('resource_id')
+        for _, resource_rows in self.iterate_resource_groups(rows, resource_id_position):
+            yield self.aggregate_resource(resource_rows, columns)
+
+    @staticmethod
+    def iterate_resource_groups(software_rows, resource_id_position):
+        """
+        Group the consecutive rows of the same resource
+        :return: Iterator of the (resource id, rows) tuples
+        """
+        resource_id, rows = None, []
+        for row in software_rows:
+            if rows and row[resource_id_position] != resource_id:
+                yield resource_id, rows
+                rows = []
+            resource_id = row[resource_id_position]
+            rows.append(row)
+        if rows:
+            yield resource_id, rows
+
+    def merge_software(self, resources, software_groups):
+        """
+        Merge-join the resources with their software, both are ordered by the resource id, so only the software
+        of the current resource is kept in memory.
+        If the software stream fails (or `software_groups` is None because the query has failed), the software rows
+        of the remaining resources are None, so their software is fetched per resource instead of being reported empty
+        :return: Iterator of the (resource, software rows) tuples
+        """
+        def next_group():
+            try:
+                return next(software_groups, None)
+            except Exception:
+                self.logger.warning("The software of all the resources was not fetched, "
+                                    "the software of the remaining resources is fetched per resource")
+                return stream_failed
+
+        stream_failed = object()
+        current = next_group() if software_groups is not None else stream_failed
+        for resource in resources:
+            resource_id = resource['resource_id']
+            while current is not None and current is not stream_failed and current[0] < resource_id:
+                current = next_group()
+            if current is stream_failed:
+                yield resource, None
+            elif current is not None and current[0] == resource_id:
+                yield resource, current[1]
+            else:
+                yield resource, []
+
+    def get_inventory_watermark(self):
+        """
+        Return the latest hardware and software inventory scan times known to SCCM right now
+        """
+        column_index, rows = self.stream_query(InventoryWatermarkSQL)
+        # the single row, the stream is read to the end so the cursor is closed
+        rows = list(rows)
+        if not rows:
+            return None
+        return {column: rows[0][position].isoformat() if rows[0][position] else None for column, position in column_index.items()}
+
+    def get_changed_resources_filter(self):
+        """
+        Return the SQL filter of the changed resources and its parameters or None if all the resources must be loaded
+        """
+        if not self.incremental_sync:
+            return None
+
+        previous = get_state_store().get_value(INVENTORY_WATERMARK_NAMESPACE, self.state_key)
+        if not previous or not all(previous.get(key) for key in ('last_hardware_scan', 'last_software_scan', 'full_sync')):
+            self.logger.info("No inventory watermark of the previous sync, running the full sync")
+            return None
+
+        if datetime.fromisoformat(previous['full_sync']) < datetime.utcnow() - timedelta(days=self.full_sync_interval_days):
+            self.logger.info("Last full sync was on %s, running the full sync", previous['full_sync'])
+            return None
+
+        self.logger.info("Running the incremental sync of the resources inventoried after %s (hardware) or %s (software)",
+                         previous['last_hardware_scan'], previous['last_software_scan'])
+        return ChangedResourcesFilter, (datetime.fromisoformat(previous['last_hardware_scan']),
+                                        datetime.fromisoformat(previous['last_software_scan']))
+
+    def save_inventory_watermark(self, watermark, full_sync):
+        """
+        Remember the inventory scan times the completed sync has covered and the time of the last full sync
+        """
+        store = get_state_store()
+        previous = store.get_value(INVENTORY_WATERMARK_NAMESPACE, self.state_key) or {}
+        watermark = dict(watermark, full_sync=datetime.utcnow().isoformat() if full_sync else previous.get('full_sync'))
+        store.set(INVENTORY_WATERMARK_NAMESPACE, self.state_key, watermark)
+        store.flush()
 
     def _load_records(self, options):
         """
         Generate audit payload for each unique computer resource.
         """
-        for resource in self.query(MainSQL):
-            yield self.build_audit(resource)
+        main_sql, main_args = MainSQL.format(filter=''), ()
+        software_sql, software_args = BulkSoftwareSQL.format(filter=''), ()
+        watermark = full_sync = None
+        if self.incremental_sync:
+            # taken before the resources are loaded, so the inventory reported during the sync is loaded by the next one
+            watermark = self.get_inventory_watermark()
+            if watermark is None:
+                self.logger.warning("The inventory scan times are not available, running the full sync")
+                changed_resources = None
+            else:
+                changed_resources = self.get_changed_resources_filter()
+            if changed_resources:
+                sql_filter, main_args = changed_resources
+                main_sql = MainSQL.format(filter=sql_filter.format(column='cs.ResourceID'))
+                software_sql = BulkSoftwareSQL.format(filter=sql_filter.format(column='ResourceID'))
+                software_args = main_args * 2
+            full_sync = changed_resources is None
 
-    def build_audit(self, resource):
+        # the incremental sync must not skip the resources silently, so the failed resource query stops it
+        query_errors = self.query_errors
+        resources = self.iterate_resources(main_sql, *main_args, raise_errors=self.incremental_sync)
+        if self.software_loading == SOFTWARE_LOADING_PER_RESOURCE:
+            # the main connection is busy streaming the resources, the software is queried over the separate one
+            software_db = self.connect()
+            try:
+                for resource in resources:
+                    if audit := self.build_audit(resource, db=software_db):
+                        yield audit
+            finally:
+                software_db.close()
+        else:
+            # the software is streamed over the separate connection, side by side with the resources
+            software_db = self.connect()
+            # the fallback queries of the software per resource can use neither the main connection busy with
+            # the resources nor the failed software connection, so they have their own connection
+            fallback_db = None
+            try:
+                try:
+                    software_index, software_rows = self.stream_query(software_sql, *software_args, db=software_db, raise_errors=True)
+                    software_groups = self.iterate_resource_groups(software_rows, software_index.get('resource_id'))
+                except Exception:
+                    software_index, software_groups = {}, None
+
+                for resource, software_rows in self.merge_software(resources, software_groups):
+                    if software_rows is not None:
+                        yield self.build_audit(resource, self.prepare_software(software_rows, software_index))
+                        continue
+                    if fallback_db is None:
+                        fallback_db = self.connect()
+                    if audit := self.build_audit(resource, db=fallback_db):
+                        yield audit
+            finally:
+                software_db.close()
+                if fallback_db is not None:
+                    fallback_db.close()
+
+        if watermark and self.query_errors == query_errors:
+            self.save_inventory_watermark(watermark, full_sync)
+        elif watermark:
+            self.logger.warning("Some of the queries have failed, the next sync loads the same changes again")
+
+    def build_audit(self, resource, software=None, db=None):
         """
         Creates an audit object using several related tables in SCCM.
-        :return: Dictionary
+        :param software: the already loaded software of the resource, it is fetched if not given
+        :param db: the connection to fetch the software with, the main one is busy while the resources are streamed
+        :return: Dictionary or None if the software of the resource was not fetched, so it is not reported empty
         """
         try:
             # prepare audit structure
             audit = {
                 "hardware": resource,
-                "software": self.get_installed_software(resource['resource_id'])
+                "software": software if software is not None else self.get_installed_software(resource['resource_id'], db)
             }
 
             return audit
@@ -173,23 +511,30 @@ class Connector(AssetsConnector):
             self.logger.exception("Unhandled exception in build audit")
             return None
 
-    def get_installed_software(self, resource_id):
+    def get_installed_software(self, resource_id, db=None):
         """
-        Fetches the installed software that is registered in Add or Remove Programs
+        Fetches the installed software that is registered in Add or Remove Programs, the failed query raises
         :return: Array of dictionaries
         """
-        installed_software = []
-        results = self.query(SoftwareSQL, resource_id, resource_id)
+        software_index, software_rows = self.stream_query(SoftwareSQL, resource_id, resource_id, db=db, raise_errors=True)
+        return self.prepare_software(software_rows, software_index)
 
-        for software in results:
+    def prepare_software(self, rows, column_index):
+        """
+        Convert the rows of the Add or Remove Programs to the software entries, the columns are taken by their position
+        :return: Array of dictionaries
+        """
+        installed_software = []
+        name, version, publisher = column_index.get('name'), column_index.get('version'), column_index.get('publisher')
+        for software in rows:
             try:
-                software_name = software.get('name')
+                software_name = software[name]
                 if software_name in [None, ""]:
                     continue
                 installed_software.append({
                     "name": software_name,
-                    "version": software.get("version"),
-                    "publisher": software.get("publisher"),
+                    "version": software[version],
+                    "publisher": software[publisher],
                     "path": None
                 })
             except:
@@ -2,9 +2,10 @@ import arrow
 from gevent.pool import Pool
 from lib.connector import AssetsConnector
 from requests.auth import _basic_auth_str
+from utils.concurrency import AdaptiveConcurrencyMixin
 
 
-class Connector(AssetsConnector):
+class Connector(AdaptiveConcurrencyMixin, AssetsConnector):
     """
     ServiceNow Assets integration
     """
@@ -13,6 +14,9 @@ class Connector(AssetsConnector):
         'url':                  {'order': 1, 'example': 'https://xxx.service-now.com'},
         'username':             {'order': 2, 'example': "***", 'default': ""},
         'password':             {'order': 3, 'example': "***", 'default': "",},
+        'adaptive_concurrency': {'order': 4, 'default': "False"},
+        'min_concurrency':      {'order': 5, 'default': "1"},
+        'max_concurrency':      {'order': 6, 'default': "8"},
     }
     DefaultConverters = {
 
@@ -21,6 +25,10 @@ class Connector(AssetsConnector):
         'APPLICATIONS':      {'source': "software"},  # <-- default mapping for APPLICATIONS
     }
 
+    def __init__(self, section, settings):
+        super(Connector, self).__init__(section, settings)
+        self.init_concurrency('ServiceNow')
+
     def get_headers(self):
         return {
             'Authorization': _basic_auth_str(self.settings['username'], self.settings['password']),
@@ -159,7 +167,7 @@ class Connector(AssetsConnector):
         return device_info
 
     def _load_records(self, options):
-        pool_size = self.settings['__workers__']
+        pool_size = self.get_pool_size()
 
         connection_pool = Pool(size=pool_size)
 
@@ -173,3 +181,5 @@ class Connector(AssetsConnector):
                 self.paginator(all_asset_url),
                 maxsize=pool_size):
             yield asset
+
+        self.log_concurrency_stats()
@@ -1,9 +1,15 @@
-import requests
 from constants import TRUE_VALUES
 from lib.connector import AssetsConnector
-from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from copy import deepcopy
+from utils.http_transport import get_session
+
+# shared by all the guest identity calls, so they reuse the same keep-alive session
+GUEST_IDENTITY_RETRY = Retry(
+    total=5,
+    status_forcelist=[429, 500],
+    allowed_methods=["GET"]
+)
 
 
 class Connector(AssetsConnector):
@@ -96,15 +102,12 @@ class Connector(AssetsConnector):
     def _load_guest_identity(self, vm_id):
         # this endpoint returns a 503 if vmware tools is not installed
         try:
-            retry_strategy = Retry(
-                total=5,
-                status_forcelist=[429, 500],
-                allowed_methods=["GET"]
+            http = get_session(
+                self.settings['url'],
+                verify=self.get_verification(),
+                pool_size=self.settings.get('__workers__', 2),
+                max_retries=GUEST_IDENTITY_RETRY
             )
-            adapter = HTTPAdapter(max_retries=retry_strategy)
-            http = requests.Session()
-            http.mount("https://", adapter)
-            http.mount("http://", adapter)
 
             url = self._build_url(f"{self.vm_url}/{vm_id}/guest/identity")
             headers = {"vmware-api-session-id": self.session_token}
@@ -4,6 +4,8 @@ import json
 import arrow
 from lib.connector import AssetsConnector
 from constants import TRUE_VALUES
+from requests.exceptions import RequestException
+from utils.token_cache import UNAUTHORIZED_STATUS, get_access_token as get_cached_access_token, invalidate_access_token, is_unauthorized
 
 
 class Connector(AssetsConnector):
@@ -70,16 +72,39 @@ class Connector(AssetsConnector):
             'Content-Type': 'application/x-www-form-urlencoded'
         }
 
-        json_response = self.post(token_url, data={'grant_type': 'client_credentials'},
-                                  headers=basic_auth_headers, post_as_json=False).json()
+        def request_token():
+            json_response = self.post(token_url, data={'grant_type': 'client_credentials'},
+                                      headers=basic_auth_headers, post_as_json=False).json()
+            return json_response.get('access_token', ''), json_response.get('expires_in', 3600)
 
-        self.workspace_one_access_token = json_response.get('access_token', '')
-        expires_in = json_response.get('expires_in', 3600)
+        self.workspace_one_access_token, expires_in = get_cached_access_token(token_url, client_id, client_secret, request_token)
 
         # expires in 1hr according to docs, reduced by 5 minutes so we don't hit the edge case of an api call on the hour mark.
         expires_in_time = expires_in - 300 if expires_in > 600 else expires_in
         self.workspace_one_expires_in = self._get_utcnow_timestamp() + expires_in_time
 
+    def reset_access_token(self):
+        """ Forget the token rejected by the API, so the next call requests the new one instead of reusing the cached one. """
+        invalidate_access_token(self.access_token_url.format(region=self.settings.get('region', '')),
+                                self.settings.get('client_id', ''))
+        self.workspace_one_access_token = ""
+        self.workspace_one_expires_in = 0.0
+
+    def get(self, url, *args, **kwargs):
+        """ Repeat the call once with the new access token if the API has rejected the current one. """
+        try:
+            response = super(Connector, self).get(url, *args, **kwargs)
+        except RequestException as exc:
+            if not is_unauthorized(exc):
+                raise
+        else:
+            if response.status_code != UNAUTHORIZED_STATUS:
+                return response
+
+        self.logger.warning("Access token has been rejected, requesting the new one")
+        self.reset_access_token()
+        return super(Connector, self).get(url, *args, **kwargs)
+
     def populate_apps_cache(self, url):
         # First step, grab all the software/apps from workspace one.
         iteration = 0
@@ -7,6 +7,12 @@ LOGGER = logging.getLogger("converters/location")
 MAP = {}
 MAP_FIELD = None
 
+DEFAULT_FIELD = 'location_id'
+DEFAULT_LABEL = 'name'
+
+# the locations already fetched by the sync, see `preload`
+PRELOADED = {}
+
 FAILED_LOOKUP = {}
 
 
@@ -15,8 +21,10 @@ def _load_map(location_field, label_field):
     global MAP
     MAP_FIELD = location_field
 
-    LOGGER.info("Loading data for Locations converter.")
-    MAP = BaseConnector.OomnitzaConnector.get_location_mappings(location_field, label_field)
+    MAP = PRELOADED.pop((location_field, label_field), None)
+    if MAP is None:
+        LOGGER.info("Loading data for Locations converter.")
+        MAP = BaseConnector.OomnitzaConnector.get_location_mappings(location_field, label_field)
     LOGGER.info("Loaded %s locations.", len(MAP))
     if not MAP:
         LOGGER.warning("Zero locations loaded from Oomnitza.")
@@ -24,6 +32,13 @@ def _load_map(location_field, label_field):
     return MAP
 
 
+def preload(location_field, label_field, mappings):
+    """
+    Keep the locations fetched by the sync along with its other start-up calls, so the converter does not fetch them again
+    """
+    PRELOADED[(location_field, label_field)] = mappings
+
+
 def converter(field, record, value, params):
     """
     Converts an external location to an internal location based on a custom field.
@@ -32,8 +47,8 @@ def converter(field, record, value, params):
         label: Default 'name': the Oomnitza field to use as value.
     :return: nice Location name
     """
-    internal_field = params.get('field', 'location_id')
-    label_field = params.get('label', 'name')
+    internal_field = params.get('field', DEFAULT_FIELD)
+    label_field = params.get('label', DEFAULT_LABEL)
     if not internal_field:
         raise Exception("Missing Oomnitza field in Location converter.")
 
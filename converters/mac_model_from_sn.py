@@ -1,8 +1,11 @@
 import logging
-import requests
+
+from utils.http_transport import get_session
 
 logger = logging.getLogger("converters/mac_model_from_sn")  # pylint:disable=invalid-name
 
+LOOKUP_URL = "https://nam.oomnitza.com"
+
 
 def converter(field, record, value, params):
     """
@@ -17,8 +20,8 @@ def converter(field, record, value, params):
         return value
 
     try:
-        url = "{}/?sn={}".format("https://nam.oomnitza.com", serial_number)
-        response = requests.get(url)
+        url = "{}/?sn={}".format(LOOKUP_URL, serial_number)
+        response = get_session(LOOKUP_URL).get(url)
         model = response.text
         return model if not model.startswith('Error') else value
     except:
@@ -5,6 +5,7 @@ from lib import config
 from lib.connector import run_connector
 
 from lib.converters import Converter
+from utils.http_transport import TRANSPORTS
 
 LOG = logging.getLogger("connector.py")
 
@@ -42,5 +43,6 @@ def client_initiated_upload(cmdline_args):
             run_connector(connectors[name], options)
 
     Converter.run_all_cleanups()
+    TRANSPORTS.log_stats(LOG)
 
     LOG.info("Done.")
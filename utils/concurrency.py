@@ -0,0 +1,187 @@
+import logging
+import time
+from typing import Optional
+
+import gevent
+from requests.exceptions import RequestException, RetryError
+
+from constants import TRUE_VALUES
+
+LOGGER = logging.getLogger(__name__)
+
+# the responses meaning the API wants less load
+THROTTLE_STATUS_CODES = (429, 503)
+
+# the number of the calls the latency and throughput are measured on before the limit is adjusted
+DEFAULT_SAMPLE_SIZE = 20
+# the average latency of the window this many times higher than the baseline one is the spike
+DEFAULT_LATENCY_TOLERANCE = 2.0
+# how often the calls waiting for the free slot check the limit
+SLOT_POLL_INTERVAL = 0.05
+
+
+class AdaptiveConcurrency:
+    """
+    The AIMD controller of the number of the concurrent calls to some API.
+
+    The calls are measured in windows of `sample_size` calls. While the average latency of the window stays within
+    `latency_tolerance` of the baseline and the throughput grows, the limit is increased by one. The throttling
+    response (429 / 503) or the latency spike halves the limit. The limit always stays within [minimum, maximum].
+
+    The connector sizes its gevent pool to the maximum and runs every call through `call`, so the number of the calls
+    in flight never exceeds the current limit.
+    """
+
+    def __init__(self, name: str, minimum: int = 1, maximum: int = 8, initial: Optional[int] = None,
+                 sample_size: int = DEFAULT_SAMPLE_SIZE, latency_tolerance: float = DEFAULT_LATENCY_TOLERANCE):
+        self.name = name
+        self.minimum = max(int(minimum), 1)
+        self.maximum = max(int(maximum), self.minimum)
+        self.limit = min(max(int(initial or self.minimum), self.minimum), self.maximum)
+        self.sample_size = sample_size
+        self.latency_tolerance = latency_tolerance
+
+        self.active = 0
+        self._samples = []
+        self._window_started = time.monotonic()
+        self._last_decrease = 0.0
+        self._baseline_latency = None
+        self._previous_throughput = None
+        self._stats = {'calls': 0, 'throttled': 0, 'increases': 0, 'decreases': 0, 'peak_limit': self.limit}
+
+    @classmethod
+    def from_settings(cls, name: str, settings: dict, minimum: int, maximum: int) -> Optional['AdaptiveConcurrency']:
+        """
+        Build the controller if the `adaptive_concurrency` setting is enabled. The bounds can be changed with
+        the `min_concurrency` and `max_concurrency` settings, the controller starts with the number of workers
+        """
+        if settings.get('adaptive_concurrency', 'False') not in TRUE_VALUES:
+            return None
+        return cls(
+            name,
+            minimum=int(settings.get('min_concurrency') or minimum),
+            maximum=int(settings.get('max_concurrency') or maximum),
+            initial=settings.get('__workers__', 2)
+        )
+
+    def _change_limit(self, limit: int, reason: str):
+        limit = min(max(limit, self.minimum), self.maximum)
+        if limit == self.limit:
+            return
+
+        LOGGER.info("%s concurrency %s -> %s (%s)", self.name, self.limit, limit, reason)
+        self._stats['increases' if limit > self.limit else 'decreases'] += 1
+        self._stats['peak_limit'] = max(self._stats['peak_limit'], limit)
+        self.limit = limit
+
+    def _reset_window(self):
+        self._samples = []
+        self._window_started = time.monotonic()
+
+    def _decrease(self, reason: str):
+        self._last_decrease = time.monotonic()
+        self._change_limit(self.limit // 2, reason)
+        # the measurements of the previous limit are not relevant anymore
+        self._previous_throughput = None
+        self._reset_window()
+
+    def record(self, started: float, latency: float, throttled: bool = False):
+        """
+        Take into account the finished call, adjust the limit once the window is complete
+        """
+        self._stats['calls'] += 1
+        if started < self._last_decrease:
+            # the call was issued under the previous limit, it says nothing about the current one
+            return
+
+        if throttled:
+            self._stats['throttled'] += 1
+            self._decrease('throttled by the API')
+            return
+
+        self._samples.append(latency)
+        if len(self._samples) < self.sample_size:
+            return
+
+        average_latency = sum(self._samples) / len(self._samples)
+        throughput = len(self._samples) / max(time.monotonic() - self._window_started, 1e-6)
+        if self._baseline_latency is None:
+            self._baseline_latency = average_latency
+
+        if average_latency > self._baseline_latency * self.latency_tolerance:
+            self._decrease(f'latency {average_latency:.2f}s, baseline {self._baseline_latency:.2f}s')
+            return
+
+        # follow the slow changes of the latency, the spikes do not move the baseline
+        self._baseline_latency = 0.8 * self._baseline_latency + 0.2 * average_latency
+        if self._previous_throughput is None or throughput > self._previous_throughput:
+            self._change_limit(self.limit + 1, f'throughput {throughput:.1f}/s')
+        self._previous_throughput = throughput
+        self._reset_window()
+
+    @staticmethod
+    def is_throttled(response=None, exc: Optional[Exception] = None) -> bool:
+        if isinstance(exc, RetryError):
+            return True
+        if exc is not None:
+            response = getattr(exc, 'response', None)
+        return getattr(response, 'status_code', None) in THROTTLE_STATUS_CODES
+
+    def call(self, method, *args, **kwargs):
+        """
+        Wait for the free slot within the current limit, perform the call and measure it
+        """
+        while self.active >= self.limit:
+            gevent.sleep(SLOT_POLL_INTERVAL)
+
+        self.active += 1
+        started = time.monotonic()
+        throttled = False
+        try:
+            response = method(*args, **kwargs)
+            throttled = self.is_throttled(response=response)
+            return response
+        except RequestException as exc:
+            throttled = self.is_throttled(exc=exc)
+            raise
+        finally:
+            self.active -= 1
+            self.record(started, time.monotonic() - started, throttled)
+
+    def get_stats(self) -> dict:
+        return dict(self._stats, limit=self.limit, minimum=self.minimum, maximum=self.maximum)
+
+    def log_stats(self, logger=None):
+        stats = self.get_stats()
+        (logger or LOGGER).info(
+            "%s concurrency: final %s, peak %s within [%s, %s], %s calls, %s throttled, %s increases, %s decreases",
+            self.name, stats['limit'], stats['peak_limit'], stats['minimum'], stats['maximum'],
+            stats['calls'], stats['throttled'], stats['increases'], stats['decreases']
+        )
+
+
+class AdaptiveConcurrencyMixin:
+    """
+    Run the GET calls of the connector through the AdaptiveConcurrency controller if the `adaptive_concurrency`
+    setting is enabled, so the number of the concurrent calls follows the latency and the throttling of the API
+    instead of the fixed number of workers. The connector calls `init_concurrency` once its settings are loaded
+    and sizes its gevent pool with `get_pool_size`
+    """
+    MaxConcurrency = 8
+
+    concurrency = None
+
+    def init_concurrency(self, name: str):
+        self.concurrency = AdaptiveConcurrency.from_settings(name, self.settings, minimum=1, maximum=self.MaxConcurrency)
+
+    def get(self, url, *args, **kwargs):
+        if self.concurrency:
+            return self.concurrency.call(super().get, url, *args, **kwargs)
+        return super().get(url, *args, **kwargs)
+
+    def get_pool_size(self) -> int:
+        return self.concurrency.maximum if self.concurrency else self.settings.get('__workers__', 2)
+
+    def log_concurrency_stats(self):
+        if self.concurrency:
+            self.concurrency.log_stats(self.logger)
@@ -0,0 +1,141 @@
+import logging
+import threading
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+LOGGER = logging.getLogger(__name__)
+
+# the requests' own default, used when the caller does not know its concurrency
+DEFAULT_POOL_SIZE = 10
+
+
+class TransportRegistry:
+    """
+    Process-wide registry of the keep-alive HTTP sessions.
+
+    The sessions are shared per (scheme, host, TLS settings, retry policy), so all the connectors, converters and
+    syncs talking to the same host reuse the already established TCP+TLS connections instead of opening new ones
+    for every call. The connection pool of the session is sized to the number of workers using it
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._pool_sizes = {}
+        self._checkouts = {}
+        # the connections and requests of the adapters replaced by the larger ones
+        self._retired_counts = {}
+
+    @staticmethod
+    def _build_key(url, verify, cert, max_retries):
+        parsed = urlparse(url)
+        if isinstance(cert, list):
+            cert = tuple(cert)
+        return parsed.scheme.lower(), parsed.netloc.lower(), verify, cert, max_retries
+
+    @staticmethod
+    def _mount(session, key, pool_size, max_retries):
+        adapter_kwargs = {'pool_connections': 1, 'pool_maxsize': pool_size}
+        if max_retries is not None:
+            adapter_kwargs['max_retries'] = max_retries
+        session.mount(f'{key[0]}://{key[1]}', HTTPAdapter(**adapter_kwargs))
+
+    @staticmethod
+    def _count_connections(adapter):
+        """
+        Return the number of the opened connections, the sent requests and the idle connections of the adapter
+        """
+        opened = requests_sent = idle = 0
+        for pool_key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools[pool_key]
+            opened += pool.num_connections
+            requests_sent += pool.num_requests
+            if pool.pool is not None:
+                idle += sum(1 for connection in list(pool.pool.queue) if connection is not None)
+        return opened, requests_sent, idle
+
+    def get_session(self, url, verify=True, cert=None, pool_size: Optional[int] = None, max_retries=None) -> requests.Session:
+        """
+        Return the shared session for the host of the given url.
+
+        :param url: any url of the host, only the scheme and the host are taken into account
+        :param verify: TLS verification setting, the sessions with different settings are never shared
+        :param cert: client certificate, the sessions with different certificates are never shared
+        :param pool_size: the expected number of concurrent workers, the pool grows to fit the largest one requested
+        :param max_retries: optional urllib3 Retry policy, use a module-level constant to share the session
+        """
+        key = self._build_key(url, verify, cert, max_retries)
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                pool_size = max(pool_size or DEFAULT_POOL_SIZE, 1)
+                session = requests.Session()
+                session.verify = verify
+                session.cert = cert
+                self._mount(session, key, pool_size, max_retries)
+                self._sessions[key] = session
+                self._pool_sizes[key] = pool_size
+                self._checkouts[key] = 0
+
+            elif pool_size and pool_size > self._pool_sizes[key]:
+                previous_adapter = session.get_adapter(f'{key[0]}://{key[1]}')
+                opened, requests_sent, _ = self._count_connections(previous_adapter)
+                retired_opened, retired_requests = self._retired_counts.get(key, (0, 0))
+                self._retired_counts[key] = (retired_opened + opened, retired_requests + requests_sent)
+
+                self._mount(session, key, pool_size, max_retries)
+                self._pool_sizes[key] = pool_size
+                # the idle connections are closed now, the ones in use are closed once released
+                previous_adapter.close()
+
+            self._checkouts[key] += 1
+            return session
+
+    def get_stats(self) -> list:
+        """
+        Report the utilization of the connection pools
+        """
+        stats = []
+        with self._lock:
+            for key, session in self._sessions.items():
+                opened, requests_sent, idle = self._count_connections(session.get_adapter(f'{key[0]}://{key[1]}'))
+                retired_opened, retired_requests = self._retired_counts.get(key, (0, 0))
+                opened += retired_opened
+                requests_sent += retired_requests
+
+                stats.append({
+                    'host': f'{key[0]}://{key[1]}',
+                    'pool_size': self._pool_sizes[key],
+                    'checkouts': self._checkouts[key],
+                    'connections_opened': opened,
+                    'requests': requests_sent,
+                    'idle_connections': idle,
+                })
+        return stats
+
+    def log_stats(self, logger=LOGGER):
+        for stats in self.get_stats():
+            logger.info(
+                "HTTP pool %(host)s: size=%(pool_size)s, checkouts=%(checkouts)s, connections opened=%(connections_opened)s, "
+                "requests=%(requests)s, idle=%(idle_connections)s", stats
+            )
+
+    def close_all(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._pool_sizes.clear()
+            self._checkouts.clear()
+            self._retired_counts.clear()
+
+
+TRANSPORTS = TransportRegistry()
+
+
+def get_session(url, verify=True, cert=None, pool_size: Optional[int] = None, max_retries=None) -> requests.Session:
+    return TRANSPORTS.get_session(url, verify=verify, cert=cert, pool_size=pool_size, max_retries=max_retries)
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows, the cross-process limiting is not available there, the limiter stays process-wide
+    fcntl = None
+
+LOGGER = logging.getLogger(__name__)
+
+# the calls controlling the sync itself, they may use the headroom reserved in the bucket
+PRIORITY_CONTROL = 'control'
+# the calls moving the data (uploads, lookups), they must leave the reserved headroom untouched
+PRIORITY_DATA = 'data'
+
+
+class TokenBucket:
+    """
+    The token bucket limiting the rate of the calls to some API.
+
+    The bucket is refilled with `rate` tokens per second up to `burst` tokens. The data calls can take the token only
+    if `reserve` tokens are left for the control calls, so the uploads never starve the calls like portion finalization.
+    The `Retry-After` returned by the API blocks all the callers of the bucket until the given moment, so they wait
+    once together instead of retrying in a storm.
+
+    If the `lock_file` is given, the state of the bucket is kept in this file and shared by all the connector processes
+    on the host.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, reserve: float = 0, lock_file: Optional[str] = None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(self.rate, 1))
+        self.reserve = min(float(reserve or 0), self.burst - 1)
+        self.lock_file = lock_file if fcntl else None
+        if lock_file and not fcntl:
+            LOGGER.warning("Cross-process rate limiting is not supported on this platform, the limit is applied per process")
+
+        self._lock = threading.Lock()
+        self._state = {'tokens': self.burst, 'updated': time.time(), 'blocked_until': 0.0}
+
+    @contextmanager
+    def _locked_state(self):
+        with self._lock:
+            if not self.lock_file:
+                yield self._state
+                return
+
+            with open(self.lock_file, 'a+') as state_file:
+                fcntl.flock(state_file, fcntl.LOCK_EX)
+                try:
+                    state_file.seek(0)
+                    try:
+                        state = json.loads(state_file.read())
+                    except ValueError:
+                        state = dict(self._state)
+
+                    yield state
+
+                    state_file.seek(0)
+                    state_file.truncate()
+                    state_file.write(json.dumps(state))
+                    state_file.flush()
+                finally:
+                    fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def _refill(self, state, now):
+        elapsed = max(now - state['updated'], 0)
+        state['tokens'] = min(self.burst, state['tokens'] + elapsed * self.rate)
+        state['updated'] = now
+
+    def acquire(self, priority: str = PRIORITY_DATA):
+        """
+        Block until the call of the given priority is allowed
+        """
+        floor = 0 if priority == PRIORITY_CONTROL else self.reserve
+        while True:
+            with self._locked_state() as state:
+                now = time.time()
+                self._refill(state, now)
+                if now < state['blocked_until']:
+                    delay = state['blocked_until'] - now
+                elif state['tokens'] - 1 >= floor:
+                    state['tokens'] -= 1
+                    return
+                else:
+                    delay = (floor + 1 - state['tokens']) / self.rate
+            time.sleep(delay)
+
+    def block_for(self, seconds: float):
+        """
+        Stop all the callers for the given number of seconds, used to honor the `Retry-After` response header
+        """
+        with self._locked_state() as state:
+            now = time.time()
+            self._refill(state, now)
+            state['blocked_until'] = max(state['blocked_until'], now + seconds)
+            # do not let everybody rush in the moment the block ends
+            state['tokens'] = min(state['tokens'], 0)
+        LOGGER.warning("API asked to retry after %s seconds, throttling all the calls", seconds)
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """
+    Parse the `Retry-After` header value given either in seconds or as HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+_BUCKETS = {}
+_BUCKETS_LOCK = threading.Lock()
+
+
+def get_bucket(name: str, rate: float, burst: Optional[float] = None, reserve: float = 0,
+               lock_file: Optional[str] = None) -> TokenBucket:
+    """
+    Return the process-wide bucket registered under the given name, create it on the first call
+    """
+    with _BUCKETS_LOCK:
+        bucket = _BUCKETS.get(name)
+        if bucket is None:
+            if lock_file:
+                lock_file = os.path.abspath(lock_file)
+            bucket = _BUCKETS[name] = TokenBucket(rate, burst=burst, reserve=reserve, lock_file=lock_file)
+        return bucket
@@ -0,0 +1,183 @@
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+import gevent
+from gevent.threadpool import ThreadPool
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_STATE_DB = 'state.db'
+
+# the writes are committed in batches, the batch is closed by the number of changes or by the timer started by its first change
+COMMIT_EVERY = 50
+COMMIT_INTERVAL = 5
+
+
+class StateStore:
+    """
+    Long-lived local storage of the connector state shared by all the connectors of the process.
+
+    All the calls to sqlite are done in the single dedicated OS thread, so the gevent hub is never blocked by the
+    disk IO and the same connection is safely reused. The database works in WAL mode and the changes are committed
+    in batches. The batch is committed at the latest `COMMIT_INTERVAL` seconds after its first change even if no other
+    write comes, so the idle connector does not hold the write lock. Call `flush` when the state must be on disk now.
+
+    The generic `connector_state` table keeps the arbitrary JSON value together with the status and the checksum
+    under the (namespace, key), the connectors are expected to use their own namespace.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self._connection = None
+        self._pending_changes = 0
+        self._first_pending_at = None
+        self._commit_timer = None
+        self._worker = ThreadPool(1)
+
+    def _run(self, func, *args):
+        return self._worker.apply(func, args)
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("pragma journal_mode=WAL")
+            self._connection.execute("pragma synchronous=NORMAL")
+            self._connection.execute(
+                "create table if not exists `media_storage_state` "
+                "(`data_source_type` text, `data_source_id` text, `creation_date` int, "
+                "primary key (`data_source_type`, `data_source_id`))")
+            self._connection.execute(
+                "create table if not exists `connector_state` "
+                "(`namespace` text, `key` text, `status` text, `checksum` text, `value` text, `updated_at` int, "
+                "primary key (`namespace`, `key`))")
+            self._connection.commit()
+        return self._connection
+
+    def _fetch(self, sql, params):
+        return self._connect().execute(sql, params).fetchall()
+
+    def _write(self, sql, params):
+        connection = self._connect()
+        connection.execute(sql, params)
+        self._pending_changes += 1
+        if self._first_pending_at is None:
+            self._first_pending_at = time.monotonic()
+        if self._pending_changes >= COMMIT_EVERY or time.monotonic() - self._first_pending_at >= COMMIT_INTERVAL:
+            self._commit()
+
+    def _commit(self):
+        if self._connection is not None and self._pending_changes:
+            self._connection.commit()
+        self._pending_changes = 0
+        self._first_pending_at = None
+
+    def fetch(self, sql, params=()) -> list:
+        return self._run(self._fetch, sql, params)
+
+    def write(self, sql, params=()):
+        self._run(self._write, sql, params)
+        if self._pending_changes and self._commit_timer is None:
+            self._commit_timer = gevent.spawn_later(COMMIT_INTERVAL, self._commit_pending)
+
+    def _commit_pending(self):
+        self._commit_timer = None
+        self.flush()
+
+    def flush(self):
+        self._run(self._commit)
+
+    def close(self):
+        if self._commit_timer is not None:
+            self._commit_timer.kill(block=False)
+            self._commit_timer = None
+
+        def _close():
+            self._commit()
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+        self._run(_close)
+
+    def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the stored record as the dict with `value`, `status`, `checksum` and `updated_at` or None
+        """
+        rows = self.fetch(
+            "select `value`, `status`, `checksum`, `updated_at` from `connector_state` where `namespace` = ? and `key` = ?",
+            (namespace, key)
+        )
+        if not rows:
+            return None
+
+        value, status, checksum, updated_at = rows[0]
+        return {'value': json.loads(value) if value is not None else None, 'status': status, 'checksum': checksum, 'updated_at': updated_at}
+
+    def get_value(self, namespace: str, key: str, default=None):
+        record = self.get(namespace, key)
+        return record['value'] if record else default
+
+    def get_all(self, namespace: str, status: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Return the values of all the keys of the namespace, optionally only the ones with the given status
+        """
+        sql = "select `key`, `value` from `connector_state` where `namespace` = ?"
+        params = (namespace,)
+        if status is not None:
+            sql += " and `status` = ?"
+            params += (status,)
+        return {key: json.loads(value) if value is not None else None for key, value in self.fetch(sql, params)}
+
+    def keys(self, namespace: str, prefix: str = '') -> list:
+        """
+        Return the keys of the namespace starting with the given prefix without loading the values
+        """
+        rows = self.fetch(
+            "select `key` from `connector_state` where `namespace` = ? and substr(`key`, 1, ?) = ?",
+            (namespace, len(prefix), prefix)
+        )
+        return [row[0] for row in rows]
+
+    def set(self, namespace: str, key: str, value=None, status: Optional[str] = None, checksum: Optional[str] = None):
+        self.write(
+            "replace into `connector_state` (`namespace`, `key`, `status`, `checksum`, `value`, `updated_at`) values (?,?,?,?,?,?)",
+            (namespace, key, status, checksum, json.dumps(value), int(time.time()))
+        )
+
+    def delete(self, namespace: str, key: Optional[str] = None):
+        """
+        Delete the single key or, if the key is not given, the whole namespace
+        """
+        if key is None:
+            self.write("delete from `connector_state` where `namespace` = ?", (namespace,))
+        else:
+            self.write("delete from `connector_state` where `namespace` = ? and `key` = ?", (namespace, key))
+
+
+_STORES = {}
+
+
+def get_state_store(path: Optional[str] = None) -> StateStore:
+    """
+    Return the process-wide store, by default it is the `state.db` file in the working directory or the file set in
+    the CONNECTOR_STATE_DB environment variable
+    """
+    path = os.path.abspath(path or os.environ.get('CONNECTOR_STATE_DB') or DEFAULT_STATE_DB)
+    store = _STORES.get(path)
+    if store is None:
+        store = _STORES[path] = StateStore(path)
+    return store
+
+
+@atexit.register
+def _flush_all_stores():
+    for store in _STORES.values():
+        try:
+            store.close()
+        except Exception:
+            LOGGER.exception("Failed to save the connector state to %s", store.path)
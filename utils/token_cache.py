@@ -0,0 +1,132 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Callable, Optional, Tuple
+
+from Cryptodome.Cipher import AES
+
+from constants import TRUE_VALUES
+from utils.state_store import StateStore, get_state_store
+
+LOGGER = logging.getLogger(__name__)
+
+TOKEN_CACHE_NAMESPACE = 'oauth.tokens'
+UNAUTHORIZED_STATUS = 401
+
+# the cached token is not reused if it expires sooner than this number of seconds
+DEFAULT_SAFETY_MARGIN = 300
+KEY_DERIVATION_ROUNDS = 100000
+
+
+class TokenCache:
+    """
+    The on-disk cache of the OAuth access tokens, so the frequent short runs of the connectors do not request the new
+    token every time while the previous one is still valid.
+
+    The tokens are kept in the state store under the hash of the token URL and the client ID and encrypted with
+    AES-GCM. The key is derived from the client secret (and the optional OAUTH_TOKEN_CACHE_KEY environment variable),
+    so the token can be read back only by the one who can request it anyway.
+    """
+
+    def __init__(self, store: StateStore = None, safety_margin: int = DEFAULT_SAFETY_MARGIN):
+        self.store = store or get_state_store()
+        self.safety_margin = safety_margin
+
+    @staticmethod
+    def get_cache_key(token_url: str, client_id: str) -> str:
+        return hashlib.sha256(f'{token_url}|{client_id}'.encode()).hexdigest()
+
+    @staticmethod
+    def derive_key(cache_key: str, client_secret: str) -> bytes:
+        secret = f"{os.environ.get('OAUTH_TOKEN_CACHE_KEY', '')}|{client_secret}".encode()
+        return hashlib.pbkdf2_hmac('sha256', secret, cache_key.encode(), KEY_DERIVATION_ROUNDS)
+
+    def get(self, token_url: str, client_id: str, client_secret: str) -> Optional[Tuple[str, int]]:
+        """
+        Return the cached token and the number of seconds it can be used for or None if there is no usable token
+        """
+        cache_key = self.get_cache_key(token_url, client_id)
+        encrypted = self.store.get_value(TOKEN_CACHE_NAMESPACE, cache_key)
+        if not encrypted:
+            return None
+
+        try:
+            blob = base64.b64decode(encrypted)
+            nonce, tag, ciphertext = blob[:16], blob[16:32], blob[32:]
+            cipher = AES.new(self.derive_key(cache_key, client_secret), AES.MODE_GCM, nonce=nonce)
+            cached = json.loads(cipher.decrypt_and_verify(ciphertext, tag))
+        except (ValueError, KeyError):
+            # the secret has been changed or the record is damaged
+            LOGGER.info("Cached access token for %s cannot be decrypted, requesting the new one", token_url)
+            return None
+
+        expires_in = int(cached['expires_at'] - time.time()) - self.safety_margin
+        if expires_in <= 0:
+            return None
+        return cached['access_token'], expires_in
+
+    def set(self, token_url: str, client_id: str, client_secret: str, access_token: str, expires_in: int):
+        cache_key = self.get_cache_key(token_url, client_id)
+        payload = json.dumps({'access_token': access_token, 'expires_at': time.time() + int(expires_in)}).encode()
+        cipher = AES.new(self.derive_key(cache_key, client_secret), AES.MODE_GCM)
+        ciphertext, tag = cipher.encrypt_and_digest(payload)
+        self.store.set(TOKEN_CACHE_NAMESPACE, cache_key, base64.b64encode(cipher.nonce + tag + ciphertext).decode())
+        # the next run may start right after this one
+        self.store.flush()
+
+    def invalidate(self, token_url: str, client_id: str):
+        """
+        Drop the cached token, it is called when the API has rejected the token before its expiration
+        """
+        self.store.delete(TOKEN_CACHE_NAMESPACE, self.get_cache_key(token_url, client_id))
+        self.store.flush()
+
+
+def get_token_cache() -> Optional[TokenCache]:
+    """
+    Return the token cache if it is enabled with the OAUTH_TOKEN_CACHE environment variable, None otherwise.
+    The safety margin can be changed with the OAUTH_TOKEN_CACHE_MARGIN environment variable
+    """
+    if os.environ.get('OAUTH_TOKEN_CACHE', 'False') not in TRUE_VALUES:
+        return None
+    return TokenCache(safety_margin=int(os.environ.get('OAUTH_TOKEN_CACHE_MARGIN') or DEFAULT_SAFETY_MARGIN))
+
+
+def get_access_token(token_url: str, client_id: str, client_secret: str,
+                     request_token: Callable[[], Tuple[str, int]]) -> Tuple[str, int]:
+    """
+    Return the access token and its lifetime in seconds, take it from the cache if it is enabled and has the valid one,
+    call `request_token` returning the same pair otherwise
+    """
+    token_cache = get_token_cache()
+    if token_cache:
+        cached = token_cache.get(token_url, client_id, client_secret)
+        if cached:
+            LOGGER.info("Reusing the cached access token for %s", token_url)
+            return cached
+
+    access_token, expires_in = request_token()
+    if token_cache and access_token:
+        token_cache.set(token_url, client_id, client_secret, access_token, expires_in)
+    return access_token, expires_in
+
+
+def invalidate_access_token(token_url: str, client_id: str):
+    """
+    Drop the cached token rejected by the API, so the next `get_access_token` call requests the new one
+    """
+    token_cache = get_token_cache()
+    if token_cache:
+        LOGGER.info("Access token for %s has been rejected, dropping it from the cache", token_url)
+        token_cache.invalidate(token_url, client_id)
+
+
+def is_unauthorized(exc: Exception) -> bool:
+    """
+    Check if the request has failed because the access token was rejected
+    """
+    response = getattr(exc, 'response', None)
+    return response is not None and response.status_code == UNAUTHORIZED_STATUS